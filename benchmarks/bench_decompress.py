@@ -0,0 +1,45 @@
+# Time the decompressors over every large view and picture resource in a game.
+#
+#   python benchmarks/bench_decompress.py SQ3/resource.map [min_size]
+#
+# Only the decompression step is timed; the compressed payloads are read up
+# front so that I/O does not show up in the numbers.
+
+import sys
+import time
+import parseulon
+from parseulon.utils import decomp_funcs
+
+def collect(m, rtypes, min_size):
+    payloads = {}
+    for rtype in rtypes:
+        for k, entry in sorted(getattr(m, rtype).items()):
+            raw = entry.read_raw()
+            if entry.decompressed_size < min_size:
+                continue
+            payloads.setdefault(entry.compression_method, []).append(
+                (rtype, k, raw, entry.decompressed_size))
+    return payloads
+
+def bench(method, payloads, repeat = 3):
+    func = decomp_funcs[method]
+    n_bytes = sum(p[3] for p in payloads)
+    best = None
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        for rtype, k, raw, size in payloads:
+            func(raw, size)
+        t2 = time.perf_counter()
+        if best is None or t2 - t1 < best:
+            best = t2 - t1
+    return n_bytes, best
+
+if __name__ == "__main__":
+    fn = sys.argv[1] if len(sys.argv) > 1 else "SQ3/resource.map"
+    min_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    m = parseulon.ResourceMapSCI0(fn)
+    payloads = collect(m, ("view", "picture"), min_size)
+    for method in sorted(payloads):
+        n_bytes, t = bench(method, payloads[method])
+        print("method %s: % 4i resources, % 9i bytes, %8.4fs, %10.1f bytes/s" % (
+            method, len(payloads[method]), n_bytes, t, n_bytes / t))
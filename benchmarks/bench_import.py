@@ -0,0 +1,43 @@
+# Time how long a fresh interpreter takes to import parseulon, and check
+# that no optional heavy dependency comes along with it.
+#
+#   python benchmarks/bench_import.py [repeat] [module ...]
+#
+# Every measurement is a new process, so nothing is already in sys.modules.
+# numpy is timed on its own as the floor that parseulon cannot go below.
+
+import sys
+import json
+import subprocess
+
+heavy = ("matplotlib", "yt", "midi", "asyncio", "multiprocessing",
+         "concurrent.futures")
+
+probe = """
+import sys, time, json
+t1 = time.perf_counter()
+import %s
+t2 = time.perf_counter()
+print(json.dumps([t2 - t1, sorted(m for m in %r if m in sys.modules)]))
+"""
+
+def measure(module, repeat):
+    best = None
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, "-c",
+                                       probe % (module, heavy)])
+        t, loaded = json.loads(out.decode().strip().splitlines()[-1])
+        if best is None or t < best:
+            best = t
+    return best, loaded
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    modules = sys.argv[2:] or ["numpy", "parseulon", "parseulon.view",
+                               "parseulon.font", "parseulon.picture",
+                               "parseulon.sound"]
+    for module in modules:
+        t, loaded = measure(module, repeat)
+        print("%-20s %8.1f ms  %s" % (module, t * 1000,
+              ", ".join(loaded) if loaded else "-"))
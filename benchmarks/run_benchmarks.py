@@ -0,0 +1,135 @@
+# Time every decoder and parser against a synthetic corpus.
+#
+#   python benchmarks/run_benchmarks.py [--size 16384] [--count 4] [--dir D]
+#                                       [--repeat 3] [--only NAME] [--draw]
+#
+# A corpus of every resource type through every compression method is
+# written to a temporary directory (or to --dir, and reused if it already
+# has a resource.map).  Each benchmark is timed without tracing, best of
+# --repeat, and then run once more under tracemalloc for its peak memory.
+# SCI0Picture.draw builds a matplotlib patch for every primitive and takes
+# minutes on a corpus of any size, so it only runs with --draw.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import parseulon
+from parseulon.utils import decompress_lzw, decompress_huffman
+from parseulon.synthetic import write_corpus
+from parseulon.view import SCI0View
+from parseulon.font import SCI0Font
+from parseulon.picture import SCI0Picture
+from parseulon.sound import SCI0Sound
+
+def payloads(m, rtype, method = None):
+    # (raw, decompressed size, data) for every resource of a type.
+    out = []
+    for k, entry in sorted(getattr(m, rtype).items()):
+        if method is not None and entry.compression_method != method:
+            continue
+        raw = bytes(entry.read_raw())
+        out.append((raw, entry.decompressed_size, entry.data))
+    return out
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        func()
+        t2 = time.perf_counter()
+        if best is None or t2 - t1 < best:
+            best = t2 - t1
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def benchmarks(directory, with_draw = False):
+    m = parseulon.ResourceMapSCI0(directory)
+    map_size = os.path.getsize(m.filename)
+    lzw = payloads(m, "view", 1) + payloads(m, "picture", 1)
+    huffman = payloads(m, "view", 2) + payloads(m, "picture", 2)
+    views = payloads(m, "view")
+    fonts = payloads(m, "font")
+    pictures = payloads(m, "picture")
+    sounds = payloads(m, "sound")
+
+    def decompress(func, items):
+        return lambda: [func(raw, size) for raw, size, data in items]
+
+    def parse(cls, items, method = None):
+        def run():
+            for raw, size, data in items:
+                obj = cls(data)
+                if method is not None:
+                    getattr(obj, method)()
+        return run
+
+    def draw():
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        for raw, size, data in pictures:
+            SCI0Picture(data).draw()
+            plt.close("all")
+
+    def total(items):
+        return sum(size for raw, size, data in items)
+
+    results = [
+        ("ResourceMap", map_size,
+         lambda: parseulon.ResourceMapSCI0(directory)),
+        ("ResourceMap (lazy)", map_size,
+         lambda: parseulon.ResourceMapSCI0(directory, lazy = True)),
+        ("decompress_lzw", total(lzw), decompress(decompress_lzw, lzw)),
+        ("decompress_huffman", total(huffman),
+         decompress(decompress_huffman, huffman)),
+        ("SCI0View", total(views), parse(SCI0View, views)),
+        ("SCI0Font", total(fonts), parse(SCI0Font, fonts)),
+        ("SCI0Picture.render", total(pictures),
+         parse(SCI0Picture, pictures, "render")),
+        ("Sound.parse_events", total(sounds),
+         parse(SCI0Sound, sounds, "parse_events")),
+    ]
+    if with_draw:
+        results.append(("SCI0Picture.draw", total(pictures), draw))
+    return results
+
+def main(argv = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default = None)
+    parser.add_argument("--size", type = int, default = 16384)
+    parser.add_argument("--count", type = int, default = 4)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--draw", action = "store_true")
+    parser.add_argument("--only", default = None,
+                        help = "run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+    directory = args.dir or tempfile.mkdtemp(prefix = "parseulon-bench-")
+    try:
+        if not os.path.isfile(os.path.join(directory, "resource.map")):
+            write_corpus(directory, args.size, args.count, seed = args.seed)
+        print("%-22s %10s %10s %14s %12s" % ("benchmark", "bytes",
+              "seconds", "bytes/s", "peak bytes"))
+        for name, n_bytes, func in benchmarks(directory, args.draw):
+            if args.only and args.only not in name:
+                continue
+            try:
+                t, peak = measure(func, args.repeat)
+            except ImportError as e:
+                print("%-22s skipped (%s)" % (name, e))
+                continue
+            print("%-22s %10i %10.4f %14.1f %12i" % (name, n_bytes, t,
+                  n_bytes / t if t else float("inf"), peak))
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,27 +1,30 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import parseulon
-import yt
+from parseulon.picture import opcode_histogram
 
 m = parseulon.ResourceMapSCI0("SQ3/resource.map")
+# Only the resource headers are read to count compression methods.
+info = m.scan_headers()
 for rtype in ("view", "picture", "script", "text",
               "sound", "vocab", "font", "cursor", "patch"):
-    n = {0:0, 1:0, 2:0}
-    for i, v in sorted(getattr(m, rtype).items()):
-        n[v.compression_method] += 1
-    print "% 10s: % 4i % 4i % 4i % 4i" % (rtype, n[0], n[1], n[2],
-        sum(n.values()))
+    n = np.bincount(info["method"][info["rtype"] == m.type_ids(rtype)[0]],
+                    minlength=3)
+    print("% 10s: % 4i % 4i % 4i % 4i" % (rtype, n[0], n[1], n[2],
+        n.sum()))
 #p = m.picture[1].view
 #m.picture[1].view.draw()
-for k in []:#sorted(m.picture):
+# Opcode statistics come straight from the decoded command arrays, without
+# drawing anything.
+for k in sorted(m.picture):
     #if m.picture[k].compression_method != 0:
     #    continue
     if not np.any(m.picture[k].data.view("uint8") == 0xff):
         continue
-    n_unk, n_tot = m.picture[k].view.draw()
-    print k, n_tot, n_unk/float(n_tot)*100
+    hist = opcode_histogram(m.picture[k].view.commands)
+    n_unk, n_tot = hist[:0xf0].sum(), hist.sum()
+    print(k, n_tot, n_unk/float(n_tot)*100)
 for k in sorted(m.sound):
     s = m.sound[k].view
     s.parse_events()
-    print "Writing", k
+    print("Writing", k)
     s.write_midi("output/sound_%05i.mid" % k)
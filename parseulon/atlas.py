@@ -0,0 +1,112 @@
+# Packing the image cells of many views into a few large textures
+
+import numpy as np
+from .view import SCI0View
+
+# Atlas pixels are EGA palette indices; this marks transparent pixels.
+TRANSPARENT = 255
+
+atlas_dtype = np.dtype([("view", "<i4"), ("loop", "<i4"), ("cell", "<i4"),
+                        ("page", "<i4"), ("x", "<i4"), ("y", "<i4"),
+                        ("w", "<i4"), ("h", "<i4"),
+                        ("x_off", "<i2"), ("y_off", "<i2")])
+
+def iter_image_cells(views):
+    # views maps view numbers to SCI0View objects (or to ResourceEntry
+    # objects, which are parsed on the way).
+    for vnum in sorted(views):
+        view = views[vnum]
+        if not isinstance(view, SCI0View):
+            view = view.view
+        for li, loop in enumerate(view.cells):
+            for ci, ic in enumerate(loop.image_cells):
+                yield vnum, li, ci, ic
+
+def _cell_pixels(ic):
+    pixels = ic.pixels.copy()
+    pixels[ic.pixels == ic.key] = TRANSPARENT
+    return pixels
+
+def shelf_pack(sizes, page_width, page_height, padding = 0):
+    # Place (h, w) rectangles on shelves, tallest first.  Returns an array of
+    # (page, x, y) rows in the order the sizes were given.
+    sizes = np.asarray(sizes, dtype="i8").reshape((-1, 2))
+    order = np.lexsort((-sizes[:, 1], -sizes[:, 0]))
+    placed = np.zeros((sizes.shape[0], 3), dtype="i8")
+    page = x = y = shelf_h = 0
+    for i in order.tolist():
+        h, w = sizes[i]
+        if x + w > page_width:
+            x = 0
+            y += shelf_h + padding
+            shelf_h = 0
+        if y + h > page_height:
+            page += 1
+            x = y = shelf_h = 0
+        placed[i] = (page, x, y)
+        x += w + padding
+        shelf_h = max(shelf_h, h)
+    return placed
+
+class Atlas(object):
+    def __init__(self, pages, table):
+        # pages is (n_pages, height, width) uint8; table is atlas_dtype.
+        self.pages = pages
+        self.table = table
+
+    @classmethod
+    def build(cls, views, page_size = 1024, padding = 1, dedup = False):
+        records = []
+        images = []
+        index = {}
+        slots = []
+        for vnum, li, ci, ic in iter_image_cells(views):
+            pixels = _cell_pixels(ic)
+            key = (pixels.shape, pixels.tobytes()) if dedup else len(images)
+            if key not in index:
+                index[key] = len(images)
+                images.append(pixels)
+            slots.append(index[key])
+            records.append((vnum, li, ci, ic.x_off, ic.y_off))
+        sizes = [im.shape for im in images]
+        width = max([page_size] + [w for h, w in sizes])
+        height = max([page_size] + [h for h, w in sizes])
+        placed = shelf_pack(sizes, width, height, padding)
+        n_pages = int(placed[:, 0].max()) + 1 if len(images) else 0
+        pages = np.full((n_pages, height, width), TRANSPARENT, dtype="uint8")
+        for (page, x, y), im in zip(placed.tolist(), images):
+            h, w = im.shape
+            pages[page, y:y + h, x:x + w] = im
+        table = np.empty(len(records), dtype=atlas_dtype)
+        for i, ((vnum, li, ci, x_off, y_off), slot) in \
+                enumerate(zip(records, slots)):
+            page, x, y = placed[slot]
+            h, w = sizes[slot]
+            table[i] = (vnum, li, ci, page, x, y, w, h, x_off, y_off)
+        return cls(pages, table)
+
+    def lookup(self, view, loop, cell):
+        # Row of the table for one image cell, or -1.
+        t = self.table
+        rows = np.nonzero((t["view"] == view) & (t["loop"] == loop) &
+                          (t["cell"] == cell))[0]
+        return int(rows[0]) if rows.size else -1
+
+    def image(self, row):
+        # The pixels of one table row, as a view into its page.
+        r = self.table[row]
+        return self.pages[r["page"], r["y"]:r["y"] + r["h"],
+                          r["x"]:r["x"] + r["w"]]
+
+    def save(self, prefix):
+        np.save(prefix + ".pages.npy", self.pages)
+        np.save(prefix + ".table.npy", self.table)
+
+    @classmethod
+    def load(cls, prefix, mmap_mode = "r"):
+        return cls(np.load(prefix + ".pages.npy", mmap_mode = mmap_mode),
+                   np.load(prefix + ".table.npy"))
+
+    def __repr__(self):
+        return "Atlas(%s cells on %s pages of %sx%s)" % ((self.table.size,)
+            + self.pages.shape)
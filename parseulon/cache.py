@@ -0,0 +1,74 @@
+# A byte-budgeted LRU cache for decompressed resource data
+
+from collections import OrderedDict
+
+def nbytes(value):
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+class ResourceCache(object):
+    # Values are evicted, least recently used first, whenever the total size
+    # goes over max_bytes.  A max_bytes of None never evicts anything.
+    # on_evict, if given, is called with the key and value of each eviction.
+    def __init__(self, max_bytes = None, on_evict = None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default = None):
+        try:
+            value, size = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size = None):
+        if size is None:
+            size = nbytes(value)
+        self.discard(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # It would only evict everything else and then itself.
+            return
+        self._items[key] = (value, size)
+        self.nbytes += size
+        while self.max_bytes is not None and self.nbytes > self.max_bytes:
+            old_key, (old_value, old_size) = self._items.popitem(last = False)
+            self.nbytes -= old_size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old_key, old_value)
+
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "entries": len(self._items),
+                "nbytes": self.nbytes, "max_bytes": self.max_bytes}
+
+    def __repr__(self):
+        return "ResourceCache(%s entries, %s of %s bytes)" % (
+            len(self._items), self.nbytes, self.max_bytes)
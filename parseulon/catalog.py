@@ -0,0 +1,197 @@
+# A single index over the resources of many games
+#
+# build_catalog scans game directories once and writes one file holding,
+# column by column, every resource's game, type, number, location and
+# header sizes.  Catalog memory-maps the columns back in, answers queries
+# with vectorized comparisons, and only opens a game's volumes when a
+# payload is actually asked for.
+#
+# The file is an 8 byte magic, a little-endian u8 header length, a JSON
+# header (the game directories, the row count and each column's dtype and
+# offset) and then the columns, each aligned to 64 bytes.  Rows are sorted
+# by (type, game, number), so everything of one type is a contiguous run.
+
+import os
+import json
+import struct
+import numpy as np
+from .utils import type_ids, decomp_funcs, header_size, \
+    split_resource
+
+MAGIC = b"PRSLCAT1"
+ALIGN = 64
+
+catalog_columns = [("rtype", "<i2"), ("game", "<i4"), ("rnum", "<i4"),
+                   ("rfile", "<i2"), ("roff", "<i4"), ("method", "<u2"),
+                   ("comp_size", "<u2"), ("decomp_size", "<u2"),
+                   ("consistent", "u1")]
+
+def scan_game(directory, game_id):
+    # The catalog rows for one game, from its map and resource headers.
+    from .resource_map import ResourceMapSCI0
+    m = ResourceMapSCI0(directory, lazy = True)
+    try:
+        info = m.scan_headers()
+    finally:
+        for f in m.resource_files.values():
+            f.close()
+    rows = np.empty(info.size, dtype=catalog_columns)
+    for name, _ in catalog_columns:
+        if name == "game":
+            rows[name] = game_id
+        else:
+            rows[name] = info[name]
+    return rows
+
+def build_catalog(directories, filename):
+    # Scan every game directory and write the catalog.  Returns the Catalog.
+    games = []
+    parts = []
+    for directory in directories:
+        parts.append(scan_game(directory, len(games)))
+        games.append(os.path.abspath(directory))
+    rows = np.concatenate(parts) if parts else \
+        np.empty(0, dtype=catalog_columns)
+    rows = rows[np.lexsort((rows["rnum"], rows["game"], rows["rtype"]))]
+    columns = []
+    offset = 0
+    for name, dtype in catalog_columns:
+        offset = -(-offset // ALIGN) * ALIGN
+        columns.append([name, dtype, offset])
+        offset += rows.size * np.dtype(dtype).itemsize
+    header = json.dumps({"games": games, "n": int(rows.size),
+                         "columns": columns}).encode()
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, dtype, col_offset in columns:
+            f.seek(start + col_offset)
+            f.write(np.ascontiguousarray(rows[name]).tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, filename)
+    return Catalog(filename)
+
+class Catalog(object):
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError("%s is not a catalog" % filename)
+            n_header, = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(n_header).decode())
+        start = -(-(len(MAGIC) + 8 + n_header) // ALIGN) * ALIGN
+        self.games = header["games"]
+        self.size = header["n"]
+        self.columns = {}
+        for name, dtype, offset in header["columns"]:
+            if self.size:
+                col = np.memmap(filename, dtype=dtype, mode="r",
+                                offset=start + offset, shape=(self.size,))
+            else:
+                col = np.empty(0, dtype=dtype)
+            self.columns[name] = col
+        self._volumes = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def game_id(self, game):
+        # A game may be given by id, directory or directory name.
+        if isinstance(game, (int, np.integer)):
+            return int(game)
+        path = os.path.abspath(game)
+        for i, g in enumerate(self.games):
+            if g == path or os.path.basename(g) == game:
+                return i
+        raise KeyError(game)
+
+    def _type_range(self, rtype):
+        col = self.columns["rtype"]
+        return np.searchsorted(col, [rtype, rtype + 1])
+
+    def select(self, game = None, type = None, number = None,
+               min_size = None, max_size = None, method = None,
+               size_column = "decomp_size"):
+        # Row numbers of the resources matching every given condition.
+        # type may be a name or id; game, type, number and method may also
+        # be lists.
+        lo, hi = 0, self.size
+        if type is not None:
+            types = type_ids(np.atleast_1d(type).tolist())
+            if len(types) == 1:
+                lo, hi = self._type_range(types[0])
+                types = None
+        else:
+            types = None
+        rows = np.arange(lo, hi)
+        mask = np.ones(hi - lo, dtype="bool")
+        def column(name):
+            return self.columns[name][lo:hi]
+        if types is not None:
+            mask &= np.isin(column("rtype"), types)
+        if game is not None:
+            ids = [self.game_id(g) for g in np.atleast_1d(game).tolist()]
+            mask &= np.isin(column("game"), ids)
+        if number is not None:
+            mask &= np.isin(column("rnum"), np.atleast_1d(number))
+        if method is not None:
+            mask &= np.isin(column("method"), np.atleast_1d(method))
+        if min_size is not None:
+            mask &= column(size_column) >= min_size
+        if max_size is not None:
+            mask &= column(size_column) <= max_size
+        return rows[mask]
+
+    def rows(self, indices):
+        # The given rows as a structured array, with their row numbers.
+        indices = np.asarray(indices)
+        out = np.empty(indices.size, dtype=[("row", "<i8")] +
+                       catalog_columns)
+        out["row"] = indices
+        for name, _ in catalog_columns:
+            out[name] = self.columns[name][indices]
+        return out
+
+    def query(self, **conditions):
+        return self.rows(self.select(**conditions))
+
+    def volume_filename(self, row):
+        game = self.games[int(self.columns["game"][row])]
+        return os.path.join(game, "resource.%03i" %
+                            int(self.columns["rfile"][row]))
+
+    def _volume(self, fn):
+        if fn not in self._volumes:
+            self._volumes[fn] = open(fn, "rb")
+        return self._volumes[fn]
+
+    def read_raw(self, row):
+        # The compressed payload of one row; this is the first point at
+        # which any of the game's files are opened.
+        f = self._volume(self.volume_filename(row))
+        f.seek(int(self.columns["roff"][row]))
+        size = header_size + int(self.columns["comp_size"][row])
+        header, raw = split_resource(f.read(size))
+        return raw
+
+    def payload(self, row, parse = False):
+        # The decompressed data (or the parsed object) of one row.
+        data = decomp_funcs[int(self.columns["method"][row])](
+            self.read_raw(row), int(self.columns["decomp_size"][row]))
+        if parse:
+            from .resource import parse_resource
+            return parse_resource(int(self.columns["rtype"][row]), data)
+        return data
+
+    def close(self):
+        for f in self._volumes.values():
+            f.close()
+        self._volumes.clear()
+
+    def __repr__(self):
+        return "Catalog(%s resources in %s games)" % (self.size,
+                                                      len(self.games))
@@ -0,0 +1,124 @@
+# Compressors that produce what the decompressors in utils read back.  They
+# are for writing resources (synthetic test data, repacked volumes); Sierra's
+# own tools may well have chosen different codes for the same data.
+
+import numpy as np
+from .utils import get_low_bits
+
+def compress_uncompressed(data):
+    return bytes(memoryview(data).cast("B"))
+
+def compress_lzw(data):
+    # LZW with the table behaviour decompress_lzw expects: 9 to 12 bit
+    # tokens packed LSB-first, 0x100 to reset, 0x101 to end, and the width
+    # growing only once the table has run past the current end token.
+    # Entries are keyed on (prefix token << 8 | next byte).
+    data = bytes(memoryview(data).cast("B"))
+    out = bytearray()
+    bitbuf = nbuf = 0
+    numbits = 9
+    endtoken = 0x1ff
+    curtoken = 0x0102
+    table = {}
+    i = 0
+    n = len(data)
+    while i < n:
+        token = data[i]
+        j = i + 1
+        while j < n:
+            nxt = table.get(token << 8 | data[j])
+            if nxt is None:
+                break
+            token = nxt
+            j += 1
+        bitbuf |= token << nbuf
+        nbuf += numbits
+        while nbuf >= 8:
+            out.append(bitbuf & 0xff)
+            bitbuf >>= 8
+            nbuf -= 8
+        if curtoken > endtoken and numbits < 12:
+            numbits += 1
+            endtoken = (endtoken << 1) + 1
+        if curtoken <= endtoken:
+            if j < n:
+                table[token << 8 | data[j]] = curtoken
+            curtoken += 1
+        else:
+            # The table is full; start over with 9 bit tokens.
+            bitbuf |= 0x100 << nbuf
+            nbuf += numbits
+            numbits = 9
+            endtoken = 0x1ff
+            curtoken = 0x0102
+            table = {}
+        i = j
+    bitbuf |= 0x101 << nbuf
+    nbuf += numbits
+    while nbuf > 0:
+        out.append(bitbuf & 0xff)
+        bitbuf >>= 8
+        nbuf -= 8
+    return bytes(out)
+
+# A comb-shaped tree can hold at most this many leaves: two nodes per leaf
+# and a one-byte node count.
+max_huffman_leaves = 127
+
+def _comb_leaves(counts, terminator):
+    # The most frequent bytes, as many as pay for themselves.  The k-th
+    # leaf of a comb costs k+1 bits, and everything else is an escape of
+    # (number of leaves + 1) bits plus an 8 bit literal.
+    order = [int(v) for v in np.argsort(-counts, kind="stable")
+             if counts[v] and v != terminator]
+    c = counts[order].astype("i8")
+    best = None
+    for n_leaves in range(min(len(order), max_huffman_leaves - 1) + 1):
+        escapes = int(c[n_leaves:].sum())
+        bits = (int((c[:n_leaves] * np.arange(1, n_leaves + 1)).sum()) +
+                escapes * (n_leaves + 2 + 8) + n_leaves + 1)
+        if best is None or bits < best[0]:
+            best = (bits, n_leaves)
+    return order[:best[1]]
+
+def compress_huffman(data):
+    # Huffman coding with a comb-shaped tree: the i-th leaf has code
+    # "1"*i + "0", the terminator is the last leaf, and a run of ones past
+    # it is the escape for an 8 bit literal.  Bits are packed MSB-first.
+    data = bytes(memoryview(data).cast("B"))
+    counts = np.bincount(np.frombuffer(data, dtype="u1"), minlength=256)
+    terminator = int(np.argmin(counts))
+    leaves = _comb_leaves(counts, terminator) + [terminator]
+    nodes = bytearray()
+    for j, value in enumerate(leaves):
+        last = j == len(leaves) - 1
+        nodes += bytes((0, (1 << 4) | (0 if last else 2)))
+        nodes += bytes((value, 0))
+    codes = [None] * 256
+    for j, value in enumerate(leaves):
+        codes[value] = (get_low_bits(j) << 1, j + 1)
+    escape = get_low_bits(len(leaves))
+    for value in range(256):
+        if codes[value] is None or value == terminator:
+            codes[value] = (escape << 8 | value, len(leaves) + 8)
+    out = bytearray()
+    bitbuf = nbuf = 0
+    for value in data:
+        code, length = codes[value]
+        bitbuf = bitbuf << length | code
+        nbuf += length
+        if nbuf >= 8:
+            nbuf_left = nbuf & 7
+            out += (bitbuf >> nbuf_left).to_bytes(nbuf >> 3, "big")
+            bitbuf &= get_low_bits(nbuf_left)
+            nbuf = nbuf_left
+    code, length = (get_low_bits(len(leaves) - 1) << 1, len(leaves))
+    bitbuf = bitbuf << length | code
+    nbuf += length
+    pad = -nbuf % 8
+    out += (bitbuf << pad).to_bytes((nbuf + pad) >> 3, "big")
+    return bytes((len(nodes) // 2, terminator)) + bytes(nodes) + bytes(out)
+
+comp_funcs = {0: compress_uncompressed,
+              1: compress_lzw,
+              2: compress_huffman}
@@ -0,0 +1,136 @@
+# Sharing decoded resources between maps
+#
+# Games built on the same interpreter ship many byte-identical fonts,
+# cursors, views and sounds.  A DedupStore, attached to any number of maps
+# with ResourceMap.share(store), keys decoded data by its content hash so
+# each distinct payload is decompressed, held and parsed only once:
+#
+#   store = DedupStore()
+#   for d in games:
+#       ResourceMapSCI0(d, lazy = True).share(store)
+#
+# Lookups go through the hash of the compressed payload first, so a
+# resource whose compressed bytes have been seen before is not decoded at
+# all.  Shared buffers are made read-only; shared parsed objects are the
+# same object for every owner, and should be treated as read-only too.
+#
+# max_bytes bounds everything the store holds: decoded buffers and parsed
+# objects (charged for the data they keep) share one LRU budget, and the
+# bookkeeping of a buffer goes when the buffer is evicted.
+
+import numpy as np
+from .cache import ResourceCache, nbytes
+
+_missing = object()
+
+class DedupStore(object):
+    def __init__(self, max_bytes = None):
+        # {digest: data} and {(rtype, digest): parsed object}, optionally
+        # byte-budgeted like a map's own cache.
+        self.buffers = ResourceCache(max_bytes, self._evicted)
+        # {raw digest: digest}, and back
+        self.raw = {}
+        self.raw_digests = {}
+        # {digest: set of (map filename, rtype, rnum)}
+        self.owners = {}
+        # {digest: decoded size}
+        self.sizes = {}
+        self.stored = 0
+        self.shared = 0
+        self.parses = 0
+
+    def lookup(self, raw_digest):
+        # (digest, data) for a compressed payload already decoded, if the
+        # decoded data is still held.
+        digest = self.raw.get(raw_digest)
+        if digest is None:
+            return None
+        data = self.buffers.get(digest)
+        if data is None:
+            return None
+        return digest, data
+
+    def intern(self, owner, digest, data, raw_digest = None):
+        # Record that owner holds these contents and return the one shared
+        # buffer for them, which is data itself if they are new.
+        existing = self.buffers.get(digest)
+        if existing is not None:
+            self.shared += 1
+            data = existing
+        else:
+            if isinstance(data, np.ndarray):
+                data.flags.writeable = False
+            self.buffers.put(digest, data)
+            if digest not in self.buffers:
+                # Larger than the whole budget, so never held or shared.
+                return data
+            self.sizes[digest] = nbytes(data)
+            self.stored += 1
+        self.owners.setdefault(digest, set()).add(owner)
+        if raw_digest is not None:
+            self.raw[raw_digest] = digest
+            self.raw_digests.setdefault(digest, set()).add(raw_digest)
+        return data
+
+    def parsed(self, rtype, digest, parse):
+        key = (rtype, digest)
+        obj = self.buffers.get(key, _missing)
+        if obj is _missing:
+            obj = parse()
+            self.parses += 1
+            self.buffers.put(key, obj, nbytes(getattr(obj, "data", obj)))
+        return obj
+
+    def _evicted(self, key, value):
+        # A parsed object needs no bookkeeping; a buffer takes its own along.
+        if isinstance(key, tuple):
+            return
+        self.owners.pop(key, None)
+        self.sizes.pop(key, None)
+        for raw_digest in self.raw_digests.pop(key, ()):
+            self.raw.pop(raw_digest, None)
+
+    def add(self, resource_map, types = None):
+        # Share the map through this store and decode everything in it (of
+        # the given types), so that duplicates are found.  Returns the
+        # number of resources visited.
+        resource_map.share(self)
+        info = resource_map.info
+        if types is not None:
+            info = info[np.isin(info["rtype"], resource_map.type_ids(types))]
+        n = 0
+        for rtype, rnum in zip(info["rtype"].tolist(), info["rnum"].tolist()):
+            resource_map.resources[rtype][rnum].data
+            n += 1
+        return n
+
+    def duplicates(self):
+        # {digest: sorted owners} for contents held by more than one owner.
+        return dict((digest, sorted(owners))
+                    for digest, owners in self.owners.items()
+                    if len(owners) > 1)
+
+    def saved_bytes(self):
+        # Decoded bytes, of those still held, that did not have to be held
+        # a second time.
+        return sum(self.sizes.get(digest, 0) * (len(owners) - 1)
+                   for digest, owners in self.owners.items())
+
+    def clear(self):
+        self.buffers.clear()
+        self.raw.clear()
+        self.raw_digests.clear()
+        self.owners.clear()
+        self.sizes.clear()
+
+    def info(self):
+        return {"unique": len(self.owners),
+                "owners": sum(len(o) for o in self.owners.values()),
+                "stored": self.stored, "shared": self.shared,
+                "parses": self.parses, "saved_bytes": self.saved_bytes(),
+                "nbytes": self.buffers.nbytes}
+
+    def __repr__(self):
+        return "DedupStore(%s unique of %s resources, %s bytes)" % (
+            len(self.owners), sum(len(o) for o in self.owners.values()),
+            self.buffers.nbytes)
@@ -0,0 +1,138 @@
+# A sidecar directory of decompressed resources and derived arrays, stored as
+# .npy files so that they can be memory-mapped back in.
+
+import os
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+
+def volume_fingerprint(filename, content = False):
+    # By default a volume is identified by its path, size and modification
+    # time; with content=True it is identified by a hash of its bytes, so
+    # identical copies of a volume share their cache entries.
+    h = hashlib.sha1()
+    if content:
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    else:
+        st = os.stat(filename)
+        h.update(("%s:%s:%s" % (os.path.realpath(filename), st.st_size,
+                                st.st_mtime_ns)).encode())
+    return h.hexdigest()[:16]
+
+class DiskCache(object):
+    # Entries live in <directory>/<volume name>-<fingerprint>/, one file per
+    # resource offset and product, plus a "source" file listing the volume
+    # paths the directory stands for (several, with content validation and
+    # identical copies).  When a volume changes, so does its fingerprint;
+    # the first time we look, its path is taken off the directories of its
+    # earlier versions, and those no longer standing for any path are
+    # removed.  cleanup() also catches volumes that were changed or deleted
+    # and never looked at again.  Each lookup re-stats the volume, so one
+    # instance notices a volume rewritten under it.
+    def __init__(self, directory, validate = "stat"):
+        if validate not in ("stat", "content"):
+            raise ValueError(validate)
+        self.directory = directory
+        self.validate = validate
+        # {volume filename: ((size, mtime_ns), directory)}
+        self._directories = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def volume_directory(self, volume_fn):
+        st = os.stat(volume_fn)
+        stamp = (st.st_size, st.st_mtime_ns)
+        known = self._directories.get(volume_fn)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        fp = volume_fingerprint(volume_fn, self.validate == "content")
+        base = os.path.basename(volume_fn)
+        name = "%s-%s" % (base, fp)
+        path = os.path.join(self.directory, name)
+        source = os.path.realpath(volume_fn)
+        self._prune(base, source, name)
+        os.makedirs(path, exist_ok = True)
+        sources = self._sources(path)
+        if source not in sources:
+            self._write_sources(path, sources + [source])
+        self._directories[volume_fn] = (stamp, path)
+        return path
+
+    def _sources(self, path):
+        try:
+            with open(os.path.join(path, "source")) as f:
+                return f.read().splitlines()
+        except IOError:
+            return []
+
+    def _write_sources(self, path, sources):
+        fd, tmp = tempfile.mkstemp(dir = path, suffix = ".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(sources))
+        os.replace(tmp, os.path.join(path, "source"))
+
+    def _release(self, path, keep):
+        # Keep only the given sources for a directory, removing it if none
+        # are left.  Returns whether it was removed.
+        if keep:
+            self._write_sources(path, keep)
+            return False
+        shutil.rmtree(path, ignore_errors = True)
+        return True
+
+    def _prune(self, base, source, current):
+        # Take source off the directories of earlier versions of its volume.
+        for name in os.listdir(self.directory):
+            if name == current or not name.startswith(base + "-"):
+                continue
+            path = os.path.join(self.directory, name)
+            sources = self._sources(path)
+            if source in sources:
+                self._release(path, [s for s in sources if s != source])
+
+    def cleanup(self):
+        # Remove every directory whose volumes have all been changed or
+        # deleted since it was written.  With content validation this reads
+        # every volume still listed.  Returns the number removed.
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+            fp = name.rpartition("-")[2]
+            sources = self._sources(path)
+            live = [s for s in sources if os.path.isfile(s) and
+                    volume_fingerprint(s, self.validate == "content") == fp]
+            if live != sources:
+                removed += self._release(path, live)
+        self._directories.clear()
+        return removed
+
+    def path(self, volume_fn, offset, product = "data"):
+        return os.path.join(self.volume_directory(volume_fn),
+                            "%08x.%s.npy" % (offset, product))
+
+    def load(self, volume_fn, offset, product = "data"):
+        fn = self.path(volume_fn, offset, product)
+        if not os.path.exists(fn):
+            return None
+        try:
+            return np.load(fn, mmap_mode = "r")
+        except ValueError:
+            # Empty arrays cannot be mapped.
+            return np.load(fn)
+
+    def store(self, volume_fn, offset, arr, product = "data"):
+        # Write to a temporary file first so readers never see half an entry.
+        fn = self.path(volume_fn, offset, product)
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(fn), suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(arr))
+            os.replace(tmp, fn)
+        except:
+            os.unlink(tmp)
+            raise
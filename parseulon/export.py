@@ -0,0 +1,115 @@
+# Batch export of picture planes and view cells to indexed PNGs
+#
+#   python -m parseulon.export SQ3/ out/ [--workers N] [--max-mb M]
+#
+# Pictures are rasterized with Picture.render and view cells are taken
+# straight from their pixel arrays; both are written as 8-bit palette PNGs
+# with the EGA palette, view cells with their key colour transparent.  The
+# decoding, rendering and PNG encoding all happen in a process pool (see
+# parallel.py); the parent only writes files, which is what lets it hold
+# the output to a byte budget exactly.
+
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from .parallel import chunk_records, decode_records
+from .png import encode_png
+
+picture_planes = ("visual", "priority", "control")
+
+def picture_filename(rnum, plane):
+    return "picture_%03i_%s.png" % (rnum, plane)
+
+def cell_filename(rnum, loop, cell):
+    return "view_%03i_%02i_%02i.png" % (rnum, loop, cell)
+
+def encode_resource(rtype_name, rnum, obj, planes = picture_planes,
+                    level = 9):
+    # [(filename, png bytes)] for one parsed picture or view.
+    out = []
+    if rtype_name == "picture":
+        rendered = obj.render()
+        for plane in planes:
+            out.append((picture_filename(rnum, plane),
+                        encode_png(rendered[plane], level = level)))
+    elif rtype_name == "view":
+        for li, loop in enumerate(obj.cells):
+            for ci, ic in enumerate(loop.image_cells):
+                out.append((cell_filename(rnum, li, ci),
+                            encode_png(ic.pixels, transparent = ic.key,
+                                       level = level)))
+    return out
+
+def _export_chunk(volume_fn, records, planes, level):
+    # Runs in a worker: decode, parse, render and encode a chunk of one
+    # volume, returning the PNGs for the parent to write.
+    from .utils import resource_types
+    out = []
+    for rtype, rnum, data, parsed in decode_records(volume_fn, records,
+                                                    parse = True):
+        out.extend(encode_resource(resource_types[rtype], rnum, parsed,
+                                   planes, level))
+    return out
+
+def export_images(resource_map, directory, types = ("picture", "view"),
+                  planes = picture_planes, workers = None, max_bytes = None,
+                  level = 9, chunksize = 8):
+    # Write every picture plane and view cell of the map into directory.
+    # Once the next file would take the total past max_bytes, the export
+    # stops.  Returns {"files": written, "bytes": total, "complete": whether
+    # everything was written}.
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    chunks = chunk_records(resource_map, types, chunksize)
+    summary = {"files": 0, "bytes": 0, "complete": True}
+
+    def write(results):
+        for fn, png in results:
+            if max_bytes is not None and \
+                    summary["bytes"] + len(png) > max_bytes:
+                summary["complete"] = False
+                return False
+            with open(os.path.join(directory, fn), "wb") as f:
+                f.write(png)
+            summary["files"] += 1
+            summary["bytes"] += len(png)
+        return True
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for fn, records in chunks:
+            if not write(_export_chunk(fn, records, planes, level)):
+                break
+        return summary
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        # Results are written in submission order, so the files that fit a
+        # budget are the same whatever order the workers finish in.
+        futures = [pool.submit(_export_chunk, fn, records, planes, level)
+                   for fn, records in chunks]
+        for future in futures:
+            if not write(future.result()):
+                for f in futures:
+                    f.cancel()
+                break
+    return summary
+
+def main(argv = None):
+    from .resource_map import ResourceMapSCI0
+    parser = argparse.ArgumentParser()
+    parser.add_argument("game")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--max-mb", type = float, default = None)
+    parser.add_argument("--types", default = "picture,view")
+    args = parser.parse_args(argv)
+    m = ResourceMapSCI0(args.game)
+    max_bytes = None if args.max_mb is None else int(args.max_mb * (1 << 20))
+    summary = export_images(m, args.directory, args.types.split(","),
+                            workers = args.workers, max_bytes = max_bytes)
+    print("%s files, %s bytes%s" % (summary["files"], summary["bytes"],
+          "" if summary["complete"] else " (stopped at the size budget)"))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
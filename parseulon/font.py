@@ -1,8 +1,7 @@
 import numpy as np
 import struct
-from .utils import get_low_bits, get_high_bits
-from yt.utilities.lib.bitarray import bitarray
 
+glyph_dtype = np.dtype([("x", "<i4"), ("width", "u1"), ("height", "u1")])
 
 class Font(object):
     def __init__(self, data):
@@ -11,31 +10,134 @@ class Font(object):
 class SCI0Font(Font):
     def __init__(self, data):
         super(SCI0Font, self).__init__(data)
-        sdata = data.tostring()
-        _, self.num_char, self.height = struct.unpack("<HHH", sdata[:6])
+        buf = data.view("u1")
+        _, self.num_char, self.height = struct.unpack("<HHH",
+            buf[:6].tobytes())
         self.char_locations = struct.unpack("<%sH" % self.num_char,
-            sdata[6:6+2*self.num_char])
-        self.char_bitmaps = {}
-        pointers = [cl for cl in self.char_locations] + [len(sdata)]
-        for i, (si, ei) in enumerate(zip(pointers[:-1], pointers[1:])):
-            self._parse_char(i, sdata[si:ei])
-
-    def _parse_char(self, ci, data):
-        height, width = struct.unpack("<BB", data[:2])
-        bm_h = height
-        bm_w = int(np.ceil(width / 8.0) * 8)
-        ba = bitarray(size = bm_h*bm_w*8)
-        ba.ibuf.view("c")[:] = data[2:2+bm_h*bm_w]
-        bitmask = ba.as_bool_array().reshape((bm_w, 8*bm_h), order="F")
-        self.char_bitmaps[ci] = bitmask[:width,:height][::-1,:]
+            buf[6:6+2*self.num_char].tobytes())
+        self._decode_glyphs(buf)
+
+    def _decode_glyphs(self, buf):
+        # Every glyph is a width byte, a height byte and then height rows of
+        # MSB-first bits, each row padded to a whole byte.  All of them are
+        # unpacked in one pass into a single atlas, glyphs side by side, with
+        # a blank column on the end that spacing can point at.
+        locs = np.array(self.char_locations, dtype="i8")
+        n = locs.size
+        valid = locs + 1 < buf.size
+        locs = np.where(valid, locs, 0)
+        widths = np.where(valid, buf[locs], 0).astype("i8")
+        heights = np.where(valid, buf[locs + 1], 0).astype("i8")
+        row_bytes = (widths + 7) // 8
+        nbytes = row_bytes * heights
+        xs = np.cumsum(widths) - widths
+        self.glyphs = np.zeros(n, dtype=glyph_dtype)
+        self.glyphs["x"] = xs
+        self.glyphs["width"] = widths
+        self.glyphs["height"] = heights
+        self.line_height = int(max([self.height] + heights.tolist()))
+        self.atlas = np.zeros((self.line_height, int(widths.sum()) + 1),
+                              dtype="uint8")
+        total = int(nbytes.sum())
+        if total == 0:
+            return
+        glyph = np.repeat(np.arange(n), nbytes)
+        byte = np.arange(total) - np.repeat(np.cumsum(nbytes) - nbytes, nbytes)
+        src = np.repeat(locs + 2, nbytes) + byte
+        ok = src < buf.size
+        bits = np.unpackbits(np.where(ok, buf[np.minimum(src, buf.size - 1)],
+                                      0).astype("uint8"))
+        glyph = np.repeat(glyph, 8)
+        byte = np.repeat(byte, 8)
+        row = byte // row_bytes[glyph]
+        col = (byte % row_bytes[glyph]) * 8 + np.tile(np.arange(8), total)
+        keep = col < widths[glyph]
+        self.atlas[row[keep], xs[glyph[keep]] + col[keep]] = bits[keep]
+
+    def glyph(self, ci):
+        # The (height, width) bitmap of one character, as a view of the atlas.
+        x, w, h = self.glyphs[ci]
+        return self.atlas[:h, x:x + w]
+
+    @property
+    def char_bitmaps(self):
+        # Per-character boolean bitmaps, indexed [x, y].
+        return dict((ci, self.glyph(ci).T.astype("bool"))
+                    for ci in range(self.glyphs.size))
+
+    def _drawable(self, text):
+        # text as str, keeping only the characters this font has glyphs
+        # for.  Bytes, such as a text resource's view, are read as latin-1,
+        # and other characters outside latin-1 stand in as "?".
+        if not isinstance(text, str):
+            text = bytes(text).decode("latin-1")
+        n = self.glyphs.size
+        chars = (c if ord(c) < 256 else "?" for c in text)
+        return "".join(c for c in chars if ord(c) < n or c == "\n")
+
+    def _codes(self, text):
+        text = self._drawable(text).replace("\n", "")
+        codes = np.frombuffer(text.encode("latin-1"), dtype="u1")
+        return codes.astype("i8")
+
+    def _columns(self, codes, gap = 0):
+        # Atlas column indices that lay out ``codes`` left to right, with
+        # ``gap`` blank columns after each glyph.
+        widths = self.glyphs["width"][codes].astype("i8") + gap
+        starts = self.glyphs["x"][codes].astype("i8")
+        offsets = np.arange(widths.sum()) - np.repeat(np.cumsum(widths) -
+                                                      widths, widths)
+        cols = np.repeat(starts, widths) + offsets
+        blank = offsets >= np.repeat(widths - gap, widths)
+        cols[blank] = self.atlas.shape[1] - 1
+        return cols
+
+    def text_width(self, text):
+        return int(self.glyphs["width"][self._codes(text)].sum())
+
+    def wrap(self, text, max_width = None):
+        # Split text into lines no wider than max_width, breaking at spaces
+        # where possible and inside a word only when it does not fit alone.
+        lines = []
+        # Lines are measured and cut on the same filtered string, so that
+        # characters without glyphs cannot put the two out of step.
+        for paragraph in self._drawable(text).split("\n"):
+            if max_width is None:
+                lines.append(paragraph)
+                continue
+            line = ""
+            for word in paragraph.split(" "):
+                candidate = word if not line else line + " " + word
+                if self.text_width(candidate) <= max_width:
+                    line = candidate
+                    continue
+                if line:
+                    lines.append(line)
+                line = word
+                while self.text_width(line) > max_width and len(line) > 1:
+                    widths = np.cumsum(self.glyphs["width"][self._codes(line)])
+                    cut = max(int(np.searchsorted(widths, max_width,
+                                                  side="right")), 1)
+                    lines.append(line[:cut])
+                    line = line[cut:]
+            lines.append(line)
+        return lines
+
+    def render_text(self, text, max_width = None, color = 1):
+        # Rasterize a string into a (lines * line_height, width) uint8 buffer,
+        # glyph pixels set to ``color`` and everything else 0.
+        lines = self.wrap(text, max_width)
+        columns = [self._columns(self._codes(line)) for line in lines]
+        width = max([c.size for c in columns] + [0])
+        if max_width is not None:
+            width = max(width, max_width)
+        h = self.line_height
+        buf = np.zeros((h * len(lines), width), dtype="uint8")
+        for i, cols in enumerate(columns):
+            buf[i*h:(i+1)*h, :cols.size] = self.atlas[:, cols] * color
+        return buf
 
     def montage(self):
-        w = sum(c.shape[0] + 1 for c in self.char_bitmaps.values())
-        h = max(c.shape[1] for c in self.char_bitmaps.values())
-        arr = np.zeros((w, h), dtype="uint8")
-        x = 0
-        for ci in sorted(self.char_bitmaps):
-            c = self.char_bitmaps[ci]
-            arr[x:x + c.shape[0], :c.shape[1]] = c
-            x += c.shape[0] + 1
-        return arr
+        # All glyphs in order, one column apart, indexed [x, y].
+        codes = np.arange(self.glyphs.size)
+        return self.atlas[:, self._columns(codes, gap = 1)].T.copy()
@@ -0,0 +1,89 @@
+# Opt-in timing and byte counts for the read, decompress and parse stages
+#
+# A ResourceMap has no instrumentation until map.instrument() is called;
+# until then the only cost is one attribute check per load.
+
+import time
+import numpy as np
+from .utils import resource_types
+
+# "disk" is a load served from the disk cache instead of read + decompress.
+stages = ("read", "decompress", "parse", "disk")
+
+stats_dtype = np.dtype([("stage", "U10"), ("rtype", "<i4"), ("method", "<i4"),
+                        ("calls", "<i8"), ("bytes_in", "<i8"),
+                        ("bytes_out", "<i8"), ("seconds", "<f8")])
+
+class Instrumentation(object):
+    def __init__(self, clock = time.perf_counter):
+        # clock is any zero-argument callable returning seconds.
+        self.clock = clock
+        # Callables invoked as hook(stage, key, method, bytes_in, bytes_out,
+        # seconds) after every recorded event.
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        # {(stage, rtype, method): [calls, bytes_in, bytes_out, seconds]}
+        self.totals = {}
+        # {(rtype, rnum): seconds}, summed over every stage
+        self.resource_seconds = {}
+
+    def record(self, stage, key, method, bytes_in, bytes_out, seconds):
+        rtype = key[0]
+        row = self.totals.get((stage, rtype, method))
+        if row is None:
+            row = self.totals[stage, rtype, method] = [0, 0, 0, 0.0]
+        row[0] += 1
+        row[1] += bytes_in
+        row[2] += bytes_out
+        row[3] += seconds
+        self.resource_seconds[key] = \
+            self.resource_seconds.get(key, 0.0) + seconds
+        for hook in self.hooks:
+            hook(stage, key, method, bytes_in, bytes_out, seconds)
+
+    @property
+    def table(self):
+        # The totals as a stats_dtype array, one row per (stage, type,
+        # method).
+        rows = [(stage, rtype, method) + tuple(v) for
+                (stage, rtype, method), v in sorted(self.totals.items(),
+                    key=lambda kv: (stages.index(kv[0][0]),) + kv[0][1:])]
+        return np.array(rows, dtype=stats_dtype)
+
+    def summary(self, by = ("stage", "rtype", "method")):
+        # Totals grouped by any subset of stage, rtype and method.
+        table = self.table
+        groups = {}
+        for row in table:
+            k = tuple(row[name].item() for name in by)
+            g = groups.setdefault(k, [0, 0, 0, 0.0])
+            for i, name in enumerate(("calls", "bytes_in", "bytes_out",
+                                      "seconds")):
+                g[i] += row[name].item()
+        return groups
+
+    def hottest(self, n = 10):
+        # The n resources that took longest overall, as ((rtype, rnum),
+        # seconds) pairs.
+        items = sorted(self.resource_seconds.items(), key=lambda kv: -kv[1])
+        return items[:n]
+
+    def report(self):
+        lines = ["%-10s %-8s %6s %8s %12s %12s %10s %14s" % ("stage", "type",
+                 "method", "calls", "bytes in", "bytes out", "seconds",
+                 "bytes/s")]
+        for row in self.table:
+            seconds = row["seconds"]
+            rate = row["bytes_out"] / seconds if seconds > 0 else 0.0
+            lines.append("%-10s %-8s %6i %8i %12i %12i %10.4f %14.1f" % (
+                row["stage"], resource_types.get(int(row["rtype"]),
+                row["rtype"]), row["method"], row["calls"], row["bytes_in"],
+                row["bytes_out"], seconds, rate))
+        hot = self.hottest(5)
+        if hot:
+            lines.append("slowest: " + ", ".join("%s.%03i %.4fs" % (
+                resource_types.get(rtype, rtype), rnum, seconds)
+                for (rtype, rnum), seconds in hot))
+        return "\n".join(lines)
@@ -0,0 +1,122 @@
+# Decoding many resources at once with a process pool
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory, resource_tracker
+from .utils import decomp_funcs, resource_types, header_size, unpack_header
+from .resource import try_parse
+from .stream import VolumeReader
+
+def decode_records(volume_fn, records, parse = False, read_ahead = 64 << 10):
+    # records is a list of (rtype, rnum, offset) in one volume, ideally in
+    # offset order.  Returns a list of (rtype, rnum, data, parsed), parsed
+    # being None without parse and as try_parse gives it with.  The
+    # volume is opened for this call only, so a volume rewritten since the
+    # last call is always read as it is now.
+    results = []
+    with open(volume_fn, "rb") as f:
+        reader = VolumeReader(f, read_ahead)
+        for rtype, rnum, offset in records:
+            rinfo, comp_size, decomp_size, method = unpack_header(
+                reader.get(offset, header_size))
+            raw = reader.get(offset + header_size, comp_size)
+            results.append((rtype, rnum, method, raw, decomp_size))
+    for i, (rtype, rnum, method, raw, decomp_size) in enumerate(results):
+        data = decomp_funcs[method](raw, decomp_size)
+        parsed = try_parse(rtype, data) if parse else None
+        results[i] = (rtype, rnum, data, parsed)
+    return results
+
+def _decode_chunk(volume_fn, records, parse):
+    # Runs in a worker.  The decompressed bytes of the whole chunk go back
+    # through one shared memory block; only the small per-resource layout
+    # is pickled.  Parsed objects are pickled instead, and their data is
+    # left out of the block, so nothing crosses over twice.
+    results = decode_records(volume_fn, records, parse)
+    total = sum(data.nbytes for _, _, data, parsed in results
+                if parsed is None or parsed is data)
+    shm = shared_memory.SharedMemory(create=True, size=max(total, 1))
+    layout = []
+    pos = 0
+    for rtype, rnum, data, parsed in results:
+        if parsed is not None and parsed is not data:
+            layout.append((rtype, rnum, None, pos, 0, parsed))
+            continue
+        n = data.nbytes
+        shm.buf[pos:pos + n] = data.view("u1")
+        layout.append((rtype, rnum, data.dtype.str, pos, n, None))
+        pos += n
+    name = shm.name
+    shm.close()
+    return name, total, layout
+
+def _collect_chunk(name, total, layout):
+    # Runs in the parent: one copy out of shared memory, then release it.
+    # Yields (rtype, rnum, data, parsed), data being None for a parsed
+    # object and parsed None for data.
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        buf = np.frombuffer(shm.buf, dtype="u1", count=total).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    for rtype, rnum, dtype, pos, n, parsed in layout:
+        if parsed is not None:
+            yield rtype, rnum, None, parsed
+        else:
+            yield rtype, rnum, buf[pos:pos + n].view(dtype), None
+
+def _release_chunk(name, total, layout):
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+def chunk_records(resource_map, types = None, chunksize = 32):
+    # Group resources by volume, in offset order, into lists of chunksize.
+    info = resource_map.physical_order(types)
+    chunks = []
+    for rfile in np.unique(info["rfile"]):
+        sub = info[info["rfile"] == rfile]
+        records = list(zip(sub["rtype"].tolist(), sub["rnum"].tolist(),
+                           sub["roff"].tolist()))
+        fn = resource_map.volume_filename(rfile)
+        for i in range(0, len(records), chunksize):
+            chunks.append((fn, records[i:i + chunksize]))
+    return chunks
+
+def iter_decoded(resource_map, types = None, workers = None, parse = False,
+                 chunksize = 32):
+    # Yields (type name, number, data or parsed object) as chunks finish.
+    # With parse, types without a parser yield their data, as in
+    # stream.iter_resources.
+    chunks = chunk_records(resource_map, types, chunksize)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for fn, records in chunks:
+            for rtype, rnum, data, parsed in decode_records(fn, records,
+                                                            parse):
+                yield resource_types[rtype], rnum, parsed if parse else data
+        return
+    # Workers must share our resource tracker, or each would try to clean up
+    # the blocks it created (and we already unlinked) when it exits.
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(_decode_chunk, fn, records, parse)
+                   for fn, records in chunks]
+        pending = set(futures)
+        try:
+            for future in as_completed(futures):
+                pending.discard(future)
+                for rtype, rnum, data, parsed in \
+                        _collect_chunk(*future.result()):
+                    yield (resource_types[rtype], rnum,
+                           data if parsed is None else parsed)
+        finally:
+            # If we stopped early, free the blocks nobody collected.
+            for future in pending:
+                future.cancel()
+            for future in pending:
+                if not future.cancelled() and future.exception() is None:
+                    _release_chunk(*future.result())
@@ -1,13 +1,10 @@
 import numpy as np
 import struct
-from .utils import ega_palette
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+from .utils import ega_palette, ega_lut
+from .raster import PictureCanvas, \
+    DRAW_ENABLE_VISUAL, DRAW_ENABLE_PRIORITY, DRAW_ENABLE_CONTROL
 
 # Some magic numbers:
-DRAW_ENABLE_VISUAL   = 1
-DRAW_ENABLE_PRIORITY = 2
-DRAW_ENABLE_CONTROL  = 4
 
 PATTERN_FLAG_RECTANGLE   = 0x10
 PATTERN_FLAG_USE_PATTERN = 0x20
@@ -50,10 +47,49 @@ ega_opcode_names = {
     8: "PIC_OPX_EGA_SET_PRIORITY_TABLE"
 }
 
+def _rgba(color):
+    return tuple(float(_)/255.0 for _ in ega_palette[color]) + (1.0,)
+
+# Every opcode decodes into one or more commands; drawing opcodes give one
+# command per primitive and everything else gives a single CMD_STATE (or
+# CMD_PALETTE / CMD_UNKNOWN) command carrying the state after the opcode.
+CMD_STATE   = 0
+CMD_LINE    = 1
+CMD_PATTERN = 2
+CMD_FILL    = 3
+CMD_PALETTE = 4
+CMD_UNKNOWN = 5
+
+command_dtype = np.dtype([
+    ("index", "<i4"),           # ordinal of the opcode in the stream
+    ("offset", "<i4"),          # byte offset of the opcode
+    ("opcode", "u1"),
+    ("opx", "u1"),              # extended opcode, for PIC_OP_OPX
+    ("kind", "u1"),
+    ("x0", "<i2"), ("y0", "<i2"), ("x1", "<i2"), ("y1", "<i2"),
+    ("col1", "u1"), ("col2", "u1"), ("priority", "u1"), ("control", "u1"),
+    ("drawenable", "u1"), ("pattern_code", "u1"), ("pattern_nr", "u1")])
+
+def opcode_starts(commands):
+    # Mask selecting the first command decoded from each opcode.
+    mask = np.ones(commands.size, dtype="bool")
+    mask[1:] = commands["index"][1:] != commands["index"][:-1]
+    return mask
+
+def opcode_histogram(commands):
+    # Number of times each opcode byte appears in the stream; anything below
+    # 0xf0 is an unknown opcode.
+    return np.bincount(commands["opcode"][opcode_starts(commands)],
+                       minlength=256)
+
 class StreamProcessor(object):
+    # Reads past the end return 0xff, which terminates any coordinate list
+    # and then the picture itself.
+    padding = 64
+
     def __init__(self, data):
         self.index = 0
-        self.data = data.view("u1")
+        self.data = data.view("u1").tobytes() + b"\xff" * self.padding
 
     def peek(self):
         return self.data[self.index]
@@ -67,6 +103,10 @@ class StreamProcessor(object):
         self.index += n
 
 class Picture(object):
+    _commands = None
+    _replay = None
+    _replay_args = None
+
     def __init__(self, data, aspect = 320.0/200):
         self.data = data
         self.aspect = aspect
@@ -107,8 +147,79 @@ class Picture(object):
             x += input 
         return (x,y)
 
+    @property
+    def commands(self):
+        if self._commands is None:
+            self._commands = self.decode()
+        return self._commands
+
     def draw(self):
-        # Set up a new stream
+        # Draw an approximation of the picture with matplotlib patches, one
+        # figure per plane.
+        import matplotlib.pyplot as plt
+        for c in ("visual", "control", "priority", "aux"):
+            self.figures[c] = plt.figure(figsize = (10.0*self.aspect, 10.0))
+            self.axes[c] = self.figures[c].add_axes([0.0, 0.0, 1.0, 1.0])
+            self.axes[c].set_xlim(0, 320)
+            self.axes[c].set_ylim(-200, 0)
+        #self.axes["visual"][:] = 0xf
+        self.replay(self)
+        hist = opcode_histogram(self.commands)
+        return hist[:0xf0].sum(), hist.sum()
+
+    def render(self):
+        # Rasterize the picture into 320x190 uint8 visual, priority and
+        # control planes.
+        canvas = PictureCanvas()
+        self.replay(canvas)
+        return canvas.planes
+
+    def render_until(self, opcode_index, every = 64, max_bytes = 16 << 20):
+        # The planes as they stand after the first opcode_index opcodes.
+        # Repeated calls share a PictureReplay, so stepping or seeking only
+        # draws from the nearest checkpoint.
+        return self.picture_replay(every, max_bytes).render_until(opcode_index)
+
+    def picture_replay(self, every = 64, max_bytes = 16 << 20):
+        # The shared PictureReplay, started afresh when asked for with other
+        # checkpoint spacing or budget than the one we have.
+        if self._replay is None or self._replay_args != (every, max_bytes):
+            self._replay = PictureReplay(self, every, max_bytes)
+            self._replay_args = (every, max_bytes)
+        return self._replay
+
+    def plot(self, plane = "visual", ax = None):
+        import matplotlib.pyplot as plt
+        im = self.render()[plane]
+        if plane == "visual":
+            im = ega_lut[im]
+        if ax is None:
+            ax = plt.gca()
+        ax.imshow(im, interpolation="nearest", cmap="gray", vmin=0, vmax=15)
+        return ax
+
+    def replay(self, target, start = 0, stop = None):
+        # Hand each decoded primitive to ``target``, which is either this
+        # object (matplotlib) or a PictureCanvas.
+        for (index, offset, opcode, opx, kind, x0, y0, x1, y1, col1, col2,
+             priority, control, drawenable, pattern_code, pattern_nr) \
+                in self.commands[start:stop].tolist():
+            if kind == CMD_LINE:
+                target.dither_line(x0, y0, x1, y1, col1, col2, priority,
+                        control, drawenable)
+            elif kind == CMD_PATTERN:
+                target.draw_pattern(x0, y0, col1, col2, priority, control,
+                        drawenable,
+                        pattern_code & PATTERN_FLAG_USE_PATTERN,
+                        pattern_code & 0x07, pattern_nr,
+                        pattern_code & PATTERN_FLAG_RECTANGLE)
+            elif kind == CMD_FILL:
+                target.dither_fill(x0, y0, col1, col2, priority, control,
+                        drawenable)
+
+    def decode(self):
+        # Turn the opcode stream into a flat array of commands, with colours
+        # resolved through the palettes and coordinates made absolute.
         stream = StreamProcessor(self.data)
         palette = [default_palette.copy() for _ in range(4)]
         # Some default variables
@@ -118,34 +229,26 @@ class Picture(object):
         control = 0
         pattern_nr = 0
         pattern_code = 0
-        pattern_size = 0
-        fill_in_black = 0
-        # Now we get our new axes
-        for c in ("visual", "control", "priority", "aux"):
-            self.figures[c] = plt.figure(figsize = (10.0*self.aspect, 10.0))
-            self.axes[c] = self.figures[c].add_axes([0.0, 0.0, 1.0, 1.0])
-            self.axes[c].set_xlim(0, 320)
-            self.axes[c].set_ylim(-200, 0)
-        #self.axes["visual"][:] = 0xf
 
-        # We mandate a break later on, but a string overrun will also do it via
-        # an exception.
-        n_unk = 0
-        n_tot = 0
-        opcodes = []
-        bads = []
+        commands = []
+        def emit(kind, x0 = 0, y0 = 0, x1 = 0, y1 = 0, c1 = None, c2 = None):
+            commands.append((n_op, op_offset, opcode, opx, kind,
+                x0, y0, x1, y1,
+                col1 if c1 is None else c1, col2 if c2 is None else c2,
+                priority, control, drawenable, pattern_code, pattern_nr))
+
+        n_op = -1
         while 1:
-            n_tot += 1
+            n_op += 1
+            op_offset = stream.index
+            n_emitted = len(commands)
             opcode = stream.get()
-            opcodes.append((opcode, stream.index-1))
-            #print opcode_names.get(opcode, "UNKNOWN: %s" % (hex(opcode)))
+            opx = 0
             if opcode == 0xf0:
                 # PIC_OP_SET_COLOR
                 code = stream.get()
                 #col1, col2 = palette[default_palette[int(code/40)]][code % 40]
                 col1, col2 = palette[int(code/40)][code % 40]
-                col1 = tuple(float(_)/255.0 for _ in ega_palette[col1]) + (1.0,)
-                col2 = tuple(float(_)/255.0 for _ in ega_palette[col2]) + (1.0,)
                 drawenable |= DRAW_ENABLE_VISUAL
             elif opcode == 0xf1:
                 # PIC_OP_DISABLE_VISUAL
@@ -163,71 +266,48 @@ class Picture(object):
                 if pattern_code & PATTERN_FLAG_USE_PATTERN:
                     pattern_nr = (stream.get() >> 1) & 0x7f
                 x, y = self.get_abs_coordinates(stream)
-                self.draw_pattern(x, y, col1, col2, priority, control,
-                        drawenable,
-                        pattern_code & PATTERN_FLAG_USE_PATTERN,
-                        pattern_size, pattern_nr,
-                        pattern_code & PATTERN_FLAG_RECTANGLE)
+                emit(CMD_PATTERN, x, y)
                 while stream.peek() < 0xf0:
                     if pattern_code & PATTERN_FLAG_USE_PATTERN:
                         pattern_nr = (stream.get() >> 1) & 0x7f
                     x, y = self.get_rel_coordinates(x, y, stream)
-                    self.draw_pattern(x, y, col1, col2, priority, control,
-                            drawenable,
-                            pattern_code & PATTERN_FLAG_USE_PATTERN,
-                            pattern_size, pattern_nr,
-                            pattern_code & PATTERN_FLAG_RECTANGLE)
+                    emit(CMD_PATTERN, x, y)
             elif opcode == 0xf5:
                 # PIC_OP_RELATIVE_MEDIUM_LINES
                 oldx, oldy = self.get_abs_coordinates(stream)
                 while stream.peek() < 0xf0:
                     x, y = self.get_rel_coordinates_med(oldx, oldy, stream)
-                    self.dither_line(oldx, oldy, x, y, col1, col2, priority,
-                            control, drawenable)
+                    emit(CMD_LINE, oldx, oldy, x, y)
                     oldx, oldy = x, y
             elif opcode == 0xf6:
                 # PIC_OP_RELATIVE_LONG_LINES
                 oldx, oldy  = self.get_abs_coordinates(stream)
                 while stream.peek() < 0xf0:
                     x, y = self.get_abs_coordinates(stream)
-                    self.dither_line(oldx, oldy, x, y, col1, col2, priority,
-                            control, drawenable)
+                    emit(CMD_LINE, oldx, oldy, x, y)
                     oldx, oldy = x, y
             elif opcode == 0xf7:
                 # PIC_OP_RELATIVE_SHORT_LINES
                 oldx, oldy = self.get_abs_coordinates(stream)
                 while stream.peek() < 0xf0:
                     x, y = self.get_rel_coordinates(oldx, oldy, stream)
-                    self.dither_line(oldx, oldy, x, y, col1, col2, priority,
-                            control, drawenable)
+                    emit(CMD_LINE, oldx, oldy, x, y)
                     oldx, oldy = x, y
             elif opcode == 0xf8:
                 # PIC_OP_FILL
-                if fill_in_black:
-                    oldc1, oldc2 = c1, c2
                 while stream.peek() < 0xf0:
                     x, y = self.get_abs_coordinates(stream)
-                    self.dither_fill(x, y, col1, col2, priority, control,
-                            drawenable)
-                if fill_in_black:
-                    c1, c2 = oldc1, oldc2
+                    emit(CMD_FILL, x, y)
             elif opcode == 0xf9:
                 # PIC_OP_SET_PATTERN
-                #import pdb;pdb.set_trace()
                 pattern_code = stream.get() #& 0x37
-                pattern_size = pattern_code & 0x07
-                print("PATTERN CODE", pattern_code, pattern_size)
             elif opcode == 0xfa:
                 # PIC_OP_ABSOLUTE_PATTERNS
                 while stream.peek() < 0xf0:
                     if (pattern_code & PATTERN_FLAG_USE_PATTERN):
                         pattern_nr = (stream.get() >> 1) & 0x7f
                     x, y = self.get_abs_coordinates(stream)
-                    self.draw_pattern(x, y, col1, col2, priority, control,
-                            drawenable,
-                            pattern_code & PATTERN_FLAG_USE_PATTERN,
-                            pattern_size, pattern_nr,
-                            pattern_code & PATTERN_FLAG_RECTANGLE)
+                    emit(CMD_PATTERN, x, y)
             elif opcode == 0xfb:
                 # PIC_OP_SET_CONTROL
                 control = stream.get() & 0x0f
@@ -240,11 +320,7 @@ class Picture(object):
                 if pattern_code & PATTERN_FLAG_USE_PATTERN:
                     pattern_nr = (stream.get() >> 1) & 0x7f
                 oldx, oldy = self.get_abs_coordinates(stream)
-                self.draw_pattern(oldx, oldy, col1, col2, priority, control,
-                        drawenable,
-                        pattern_code & PATTERN_FLAG_USE_PATTERN,
-                        pattern_size, pattern_nr,
-                        pattern_code & PATTERN_FLAG_RECTANGLE)
+                emit(CMD_PATTERN, oldx, oldy)
                 while stream.peek() < 0xf0:
                     if pattern_code & PATTERN_FLAG_USE_PATTERN:
                         pattern_nr = (stream.get() >> 1) & 0x7f
@@ -254,27 +330,30 @@ class Picture(object):
                     else:
                         y = oldy + temp
                     x = oldx + stream.get()
-                    self.draw_pattern(x, y, col1, col2, priority, control,
-                                      drawenable,
-                                      pattern_code & PATTERN_FLAG_USE_PATTERN,
-                                      pattern_size, pattern_nr,
-                                      pattern_code & PATTERN_FLAG_RECTANGLE);
-
+                    emit(CMD_PATTERN, x, y)
             elif opcode == 0xfe:
                 # PIC_OP_OPX
-                temp = stream.get()
+                opx = temp = stream.get()
                 if temp == 0x00:
                     # PIC_OPX_SET_PALETTE_ENTRY
                     while stream.peek() < 0xf0:
                         index = stream.get()
                         color = stream.get()
-                        #palette[index / 40][color % 40] = color
+                        if index < 160:
+                            palette[index // 40][index % 40] = \
+                                (color >> 4, color & 0xf)
+                            emit(CMD_PALETTE, index,
+                                 c1 = color >> 4, c2 = color & 0xf)
                 elif temp == 0x01:
                     # PIC_OPX_SET_PALETTE
                     palette_number = stream.get()
                     for i in range(40):
-                        stream.get()
-                        #palette[palette_number][i] = stream.get()
+                        color = stream.get()
+                        if palette_number < 4:
+                            palette[palette_number][i] = \
+                                (color >> 4, color & 0xf)
+                            emit(CMD_PALETTE, palette_number * 40 + i,
+                                 c1 = color >> 4, c2 = color & 0xf)
                 elif temp == 0x02:
                     # PIC_OPX_MONO0
                     stream.skip(41)
@@ -295,16 +374,16 @@ class Picture(object):
                     pass
                 elif temp == 0x08:
                     # PIC_OPX_SET_PRIORITY_TABLE
-                    for i in range(14):
-                        stream.get()
+                    stream.skip(14)
                 else:
                     pass
-            elif opcode == 0xff:
+            elif opcode < 0xf0:
+                emit(CMD_UNKNOWN)
+            if len(commands) == n_emitted:
+                emit(CMD_STATE)
+            if opcode == 0xff:
                 break
-            else:
-                n_unk += 1
-                bads.append(opcode)
-        return n_unk, n_tot
+        return np.array(commands, dtype=command_dtype)
 
     def _get_axes(self, drawenable):
         to_draw = []
@@ -318,6 +397,8 @@ class Picture(object):
 
     def draw_pattern(self, x, y, col1, col2, priority, control, drawenable,
             use_pattern, pattern_size, pattern_nr, rectangle = True):
+        import matplotlib.patches as patches
+        col1 = _rgba(col1)
         x -= pattern_size
         y -= pattern_size
         if y < 0: y = 0
@@ -352,6 +433,7 @@ class Picture(object):
 
     def dither_line(self, x0, y0, x1, y1, col1, col2, priority, control,
                     drawenable):
+        col1, col2 = _rgba(col1), _rgba(col2)
         y0 = -(y0+10)
         y1 = -(y1+10)
         for ax in self._get_axes(drawenable):
@@ -362,6 +444,114 @@ class Picture(object):
     def dither_fill(self, *args, **kwargs):
         pass
 
+def palette_at(commands, opcode_index):
+    # The four (40, 2) palettes in effect before opcode opcode_index, from
+    # the CMD_PALETTE rows; a later entry for a slot replaces an earlier one.
+    palettes = np.array([default_palette] * 4)
+    rows = commands[(commands["kind"] == CMD_PALETTE) &
+                    (commands["index"] < opcode_index)][::-1]
+    slots, first = np.unique(rows["x0"], return_index=True)
+    flat = palettes.reshape((160, 2))
+    flat[slots, 0] = rows["col1"][first]
+    flat[slots, 1] = rows["col2"][first]
+    return palettes
+
+class Checkpoint(object):
+    # Everything needed to carry on drawing from opcode ``opcode``: the
+    # planes, the palettes, the drawing state (the last command row before
+    # it, or None at the start) and the row of commands to resume from.
+    def __init__(self, opcode, row, planes, palettes, state):
+        self.opcode = opcode
+        self.row = row
+        self.planes = planes
+        self.palettes = palettes
+        self.state = state
+
+    @property
+    def nbytes(self):
+        return self.planes.nbytes + self.palettes.nbytes
+
+class PictureReplay(object):
+    # Renders a picture up to any opcode.  A checkpoint is taken every
+    # ``every`` opcodes as the drawing passes them; a later request resumes
+    # from the nearest checkpoint at or before it, or just keeps going if
+    # the canvas is already on the way there.  When the checkpoints outgrow
+    # max_bytes, every other one is dropped and the spacing doubles.
+    def __init__(self, picture, every = 64, max_bytes = 16 << 20):
+        self.picture = picture
+        self.commands = picture.commands
+        self.every = max(int(every), 1)
+        self.max_bytes = max_bytes
+        self.n_opcodes = int(self.commands["index"][-1]) + 1 \
+            if self.commands.size else 0
+        self.canvas = PictureCanvas()
+        self.opcode = 0
+        self.checkpoints = {}
+        self._checkpoint()
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self.checkpoints.values())
+
+    def _row(self, opcode_index):
+        return int(np.searchsorted(self.commands["index"], opcode_index))
+
+    def _checkpoint(self):
+        row = self._row(self.opcode)
+        planes = np.stack([self.canvas.visual, self.canvas.priority,
+                           self.canvas.control])
+        state = self.commands[row - 1].copy() if row else None
+        self.checkpoints[self.opcode] = Checkpoint(self.opcode, row, planes,
+            palette_at(self.commands, self.opcode), state)
+        while self.max_bytes is not None and len(self.checkpoints) > 1 and \
+                self.nbytes > self.max_bytes:
+            self.every *= 2
+            for k in list(self.checkpoints):
+                if k % self.every:
+                    del self.checkpoints[k]
+
+    def _restore(self, checkpoint):
+        self.canvas.visual[:] = checkpoint.planes[0]
+        self.canvas.priority[:] = checkpoint.planes[1]
+        self.canvas.control[:] = checkpoint.planes[2]
+        self.opcode = checkpoint.opcode
+
+    def nearest(self, opcode_index):
+        # The latest checkpoint at or before opcode_index.
+        return self.checkpoints[max(k for k in self.checkpoints
+                                    if k <= opcode_index)]
+
+    def render_until(self, opcode_index):
+        # Copies of the planes after the first opcode_index opcodes.
+        opcode_index = min(max(int(opcode_index), 0), self.n_opcodes)
+        checkpoint = self.nearest(opcode_index)
+        if not (checkpoint.opcode <= self.opcode <= opcode_index):
+            self._restore(checkpoint)
+        while self.opcode < opcode_index:
+            stop = min((self.opcode // self.every + 1) * self.every,
+                       opcode_index)
+            self.picture.replay(self.canvas, self._row(self.opcode),
+                                self._row(stop))
+            self.opcode = stop
+            if stop % self.every == 0 and stop not in self.checkpoints:
+                self._checkpoint()
+        return dict((k, v.copy()) for k, v in self.canvas.planes.items())
+
+    def state(self, opcode_index):
+        # The drawing state after the first opcode_index opcodes, as a
+        # dict: the fields of the last command row (colours, priority,
+        # control, drawing enables, pattern settings, stream offset, and
+        # "opcode", the opcode byte), the palettes, and "opcode_index".
+        row = self._row(opcode_index)
+        state = {}
+        if row:
+            rec = self.commands[row - 1]
+            for name in self.commands.dtype.names:
+                state[name] = rec[name].item()
+        state["palettes"] = palette_at(self.commands, opcode_index)
+        state["opcode_index"] = opcode_index
+        return state
+
 class SCI0Picture(Picture):
     def __init__(self, data):
         # http://sci.sierrahelp.com/Documentation/SCISpecifications/16-SCI0-SCI01PICResource.html
@@ -0,0 +1,61 @@
+# A small PNG encoder, so that images can be written without matplotlib or
+# PIL.  Indexed images are stored as palette PNGs, which is both the most
+# faithful and the smallest form for EGA data.
+
+import zlib
+import struct
+import numpy as np
+from .utils import ega_lut
+
+def _chunk(kind, body):
+    return (struct.pack(">I", len(body)) + kind + body +
+            struct.pack(">I", zlib.crc32(kind + body) & 0xffffffff))
+
+def ega_palette_table():
+    # A 256-entry RGB palette: the 16 EGA colours, then black.
+    palette = np.zeros((256, 3), dtype="uint8")
+    palette[:16] = ega_lut
+    return palette
+
+def encode_png(pixels, palette = None, transparent = None, level = 6):
+    # pixels is (h, w) uint8 palette indices, (h, w, 3) RGB or (h, w, 4)
+    # RGBA.  For indexed images the palette defaults to EGA, and the
+    # ``transparent`` index (if any) is marked fully transparent.
+    pixels = np.ascontiguousarray(pixels, dtype="uint8")
+    h, w = pixels.shape[:2]
+    chunks = []
+    if pixels.ndim == 2:
+        color_type = 3
+        if palette is None:
+            palette = ega_palette_table()
+        palette = np.asarray(palette, dtype="uint8")
+        n_colors = max(int(pixels.max()) + 1 if pixels.size else 1,
+                       1 if transparent is None else transparent + 1)
+        n_colors = min(max(n_colors, 1), 256)
+        table = np.zeros((n_colors, 3), dtype="uint8")
+        k = min(n_colors, palette.shape[0])
+        table[:k] = palette[:k, :3]
+        chunks.append(_chunk(b"PLTE", table.tobytes()))
+        if transparent is not None:
+            alpha = np.full(transparent + 1, 255, dtype="uint8")
+            alpha[transparent] = 0
+            chunks.append(_chunk(b"tRNS", alpha.tobytes()))
+    elif pixels.shape[2] == 3:
+        color_type = 2
+    elif pixels.shape[2] == 4:
+        color_type = 6
+    else:
+        raise ValueError("Unsupported pixel shape %s" % (pixels.shape,))
+    # Each row gets filter type 0 (none) in front of it.
+    row_bytes = w * (1 if pixels.ndim == 2 else pixels.shape[2])
+    rows = np.zeros((h, 1 + row_bytes), dtype="uint8")
+    rows[:, 1:] = pixels.reshape((h, row_bytes))
+    header = struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + _chunk(b"IHDR", header) +
+            b"".join(chunks) +
+            _chunk(b"IDAT", zlib.compress(rows.tobytes(), level)) +
+            _chunk(b"IEND", b""))
+
+def write_png(filename, pixels, palette = None, transparent = None):
+    with open(filename, "wb") as f:
+        f.write(encode_png(pixels, palette, transparent))
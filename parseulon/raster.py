@@ -0,0 +1,169 @@
+# A software rasterizer for SCI0 pictures, drawing into uint8 planes.
+
+import bisect
+import numpy as np
+
+SCREEN_WIDTH = 320
+SCREEN_HEIGHT = 190
+
+DRAW_ENABLE_VISUAL   = 1
+DRAW_ENABLE_PRIORITY = 2
+DRAW_ENABLE_CONTROL  = 4
+
+def _noise_bits():
+    # Textured patterns draw through a table of 256 "random" bits, starting
+    # at an index chosen by pattern_nr.  We do not reproduce Sierra's exact
+    # table; this is the sequence of a maximal 8-bit LFSR, which gives the
+    # same sort of speckle deterministically.
+    bits = np.zeros(256, dtype="bool")
+    state = 1
+    for i in range(256):
+        bits[i] = state & 1
+        lsb = state & 1
+        state >>= 1
+        if lsb:
+            state ^= 0xb8
+    return bits
+
+noise_bits = _noise_bits()
+
+def pattern_mask(size, rectangle):
+    # Patterns are (2*size + 2) pixels wide and (2*size + 1) high, to make up
+    # for the non-square EGA pixels.  Circles are the ellipse inscribed in
+    # that box.  Like the noise table above, this is an approximation: the
+    # interpreter draws circles from eight fixed bitmaps, one per size, and
+    # these masks can differ from them by a pixel or so along the edge.
+    # Rectangles are exact.
+    h = 2 * size + 1
+    w = 2 * size + 2
+    if rectangle:
+        return np.ones((h, w), dtype="bool")
+    y, x = np.mgrid[0:h, 0:w]
+    dy = (y - (h - 1) / 2.0) / (h / 2.0)
+    dx = (x - (w - 1) / 2.0) / (w / 2.0)
+    return (dx*dx + dy*dy) <= 1.0
+
+_pattern_masks = dict(((size, rect), pattern_mask(size, rect))
+                      for size in range(8) for rect in (False, True))
+
+def flood_region(match, x, y):
+    # Returns the 4-connected region of ``match`` containing (x, y), found by
+    # walking horizontal runs of matching pixels scanline by scanline.
+    h, w = match.shape
+    padded = np.zeros((h, w + 2), dtype="int8")
+    padded[:, 1:-1] = match
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    run_ends = np.nonzero(edges == -1)[1]
+    row_first = np.searchsorted(run_rows, np.arange(h + 1)).tolist()
+    starts = run_starts.tolist()
+    ends = run_ends.tolist()
+    region = np.zeros((h, w), dtype="bool")
+    if not match[y, x]:
+        return region
+    lo, hi = row_first[y], row_first[y + 1]
+    seed = bisect.bisect_right(starts, x, lo, hi) - 1
+    seen = set([seed])
+    stack = [(y, seed)]
+    while stack:
+        row, run = stack.pop()
+        s, e = starts[run], ends[run]
+        region[row, s:e] = True
+        for nrow in (row - 1, row + 1):
+            if nrow < 0 or nrow >= h:
+                continue
+            lo, hi = row_first[nrow], row_first[nrow + 1]
+            # Runs in the next row that overlap [s, e)
+            first = bisect.bisect_right(ends, s, lo, hi)
+            last = bisect.bisect_left(starts, e, lo, hi)
+            for nrun in range(first, last):
+                if nrun not in seen:
+                    seen.add(nrun)
+                    stack.append((nrow, nrun))
+    return region
+
+class PictureCanvas(object):
+    # This exposes the same drawing primitives as Picture, so the opcode
+    # interpreter can target either one.
+    def __init__(self, width = SCREEN_WIDTH, height = SCREEN_HEIGHT):
+        self.width = width
+        self.height = height
+        self.visual = np.empty((height, width), dtype="uint8")
+        self.priority = np.empty((height, width), dtype="uint8")
+        self.control = np.empty((height, width), dtype="uint8")
+        self.clear()
+
+    def clear(self):
+        self.visual[:] = 15
+        self.priority[:] = 0
+        self.control[:] = 0
+
+    @property
+    def planes(self):
+        return {"visual": self.visual, "priority": self.priority,
+                "control": self.control}
+
+    def plot(self, ys, xs, col1, col2, priority, control, drawenable):
+        if drawenable & DRAW_ENABLE_VISUAL:
+            self.visual[ys, xs] = np.where((xs ^ ys) & 1, col2, col1)
+        if drawenable & DRAW_ENABLE_PRIORITY:
+            self.priority[ys, xs] = priority
+        if drawenable & DRAW_ENABLE_CONTROL:
+            self.control[ys, xs] = control
+
+    def dither_line(self, x0, y0, x1, y1, col1, col2, priority, control,
+                    drawenable):
+        x0 = min(max(x0, 0), self.width - 1)
+        x1 = min(max(x1, 0), self.width - 1)
+        y0 = min(max(y0, 0), self.height - 1)
+        y1 = min(max(y1, 0), self.height - 1)
+        dx = x1 - x0
+        dy = y1 - y0
+        n = max(abs(dx), abs(dy))
+        if n == 0:
+            xs = np.array([x0])
+            ys = np.array([y0])
+        else:
+            # Integer DDA, rounding to the nearest pixel along the minor axis.
+            t = np.arange(n + 1)
+            xs = x0 + (2 * t * dx + n) // (2 * n)
+            ys = y0 + (2 * t * dy + n) // (2 * n)
+        self.plot(ys, xs, col1, col2, priority, control, drawenable)
+
+    def draw_pattern(self, x, y, col1, col2, priority, control, drawenable,
+            use_pattern, pattern_size, pattern_nr, rectangle = True):
+        mask = _pattern_masks[(pattern_size & 7, bool(rectangle))]
+        h, w = mask.shape
+        # The brush is moved, not clipped, to keep it on the screen.
+        left = min(max(x - pattern_size, 0), self.width - w)
+        top = min(max(y - pattern_size, 0), self.height - h)
+        if use_pattern:
+            mask = mask.copy()
+            n = mask.sum()
+            mask[mask] = noise_bits[(pattern_nr + np.arange(n)) % 256]
+        ys, xs = np.nonzero(mask)
+        self.plot(ys + top, xs + left, col1, col2, priority, control,
+                  drawenable)
+
+    def dither_fill(self, x, y, col1, col2, priority, control, drawenable):
+        # The fill is bounded by the first enabled plane: it floods white
+        # visual pixels, or zero priority/control pixels.  Filling with the
+        # value we are searching for would do nothing.
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return
+        if drawenable & DRAW_ENABLE_VISUAL:
+            if col1 == col2 == 15:
+                return
+            match = self.visual == 15
+        elif drawenable & DRAW_ENABLE_PRIORITY:
+            if priority == 0:
+                return
+            match = self.priority == 0
+        elif drawenable & DRAW_ENABLE_CONTROL:
+            if control == 0:
+                return
+            match = self.control == 0
+        else:
+            return
+        ys, xs = np.nonzero(flood_region(match, x, y))
+        self.plot(ys, xs, col1, col2, priority, control, drawenable)
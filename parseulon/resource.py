@@ -1,16 +1,42 @@
-from .utils import decomp_funcs, resource_types
-from .view import SCI0View
-from .font import SCI0Font
-from .picture import SCI0Picture
-from .sound import SCI0Sound
+from .utils import decomp_funcs, resource_types, content_hash, \
+    header_size, unpack_header, split_resource
 import weakref
 import struct
 
+def parse_resource(r_type, data):
+    # Turn decompressed data into the object for its resource type.  The
+    # parser modules are only imported once something needs them.
+    if resource_types[r_type] == "text":
+        return data.tobytes()
+    elif resource_types[r_type] == "view":
+        from .view import SCI0View
+        return SCI0View(data)
+    elif resource_types[r_type] == "font":
+        from .font import SCI0Font
+        return SCI0Font(data)
+    elif resource_types[r_type] == "picture":
+        from .picture import SCI0Picture
+        return SCI0Picture(data)
+    elif resource_types[r_type] == "sound":
+        from .sound import SCI0Sound
+        return SCI0Sound(data)
+    else:
+        raise NotImplementedError
+
+def try_parse(r_type, data):
+    # The parsed object, or data itself for types without a parser.  This
+    # is what the bulk readers yield when asked to parse.
+    try:
+        return parse_resource(r_type, data)
+    except NotImplementedError:
+        return data
+
 class ResourceEntry(object):
-    _data = None
     _compression_method = None
     _compressed_size = None
     _decompressed_size = None
+    _digest = None
+    _raw_digest = None
 
     def __init__(self, resource_map, r_id, r_type, file_id, offset):
         # We store a proxy to the resource_map so we can both avoid cyclic
@@ -21,61 +47,208 @@ class ResourceEntry(object):
         self.file_id = file_id
         self.offset = offset
 
+    @property
+    def key(self):
+        return (self.r_type, self.r_id)
+
+    @property
+    def owner(self):
+        # Identifies the entry across maps, e.g. in a shared DedupStore.
+        return (self.resource_map.filename, self.r_type, self.r_id)
+
     @property
     def data(self):
-        if self._data is None:
-            self.load()
-        return self._data
+        # Decompressed data lives in the map's cache, so it may have been
+        # evicted since we last decoded it.
+        data = self.resource_map.cache.get(self.key)
+        if data is None:
+            data = self.load()
+        return data
 
     @property
     def compression_method(self):
         if self._compression_method is None:
-            self.load()
+            self.read_header()
         return self._compression_method
 
     @property
     def compressed_size(self):
         if self._compressed_size is None:
-            self.load()
+            self.read_header()
         return self._compressed_size
 
     @property
     def decompressed_size(self):
         if self._decompressed_size is None:
-            self.load()
+            self.read_header()
         return self._decompressed_size
 
-    def load(self, do=False):
-        # Here we actually load up the data.
+    def read_header(self):
+        # Read just the 8-byte header, returning it as unpack_header does.
+        # For file objects this leaves the file positioned at the start of
+        # the payload.
         f = self.resource_map.resource_files[self.file_id]
-        f.seek(self.offset)
-        fmt = "<4H"
-        data = f.read(struct.calcsize(fmt))
-        rinfo, comp_size, decomp_size, method = struct.unpack(fmt, data)
-        comp_size -= 4 # 4 byte offset due to header inclusion
+        if self.resource_map.use_mmap:
+            header = unpack_header(f, self.offset)
+        else:
+            f.seek(self.offset)
+            header = unpack_header(f.read(header_size))
+        self._set_header(header)
+        return header
+
+    def _set_header(self, header):
+        rinfo, comp_size, decomp_size, method = header
         self._compression_method = method
         self._compressed_size = comp_size
         self._decompressed_size = decomp_size
-        data = f.read(comp_size)
+
+    def read_raw(self):
+        # Read the header and the still-compressed payload, without decoding.
+        # Memory-mapped volumes hand back a memoryview of the mapping.
+        if self.resource_map.use_mmap:
+            f = self.resource_map.resource_files[self.file_id]
+            header, raw = split_resource(f, self.offset)
+            self._set_header(header)
+            return raw
+        self.read_header()
+        f = self.resource_map.resource_files[self.file_id]
+        return f.read(self.compressed_size)
+
+    @property
+    def digest(self):
+        # Content hash of the decompressed data.  It is computed on load
+        # when the map has a dedup store, and otherwise when first asked for.
+        if self._digest is None:
+            data = self.data
+            if self._digest is None and data is not None:
+                self._digest = content_hash(data)
+        return self._digest
+
+    @property
+    def raw_digest(self):
+        # A cheaper hash of the compressed payload and its header sizes,
+        # which needs no decompression.  Equal raw digests mean equal
+        # contents, but equal contents can be stored differently.
+        if self._raw_digest is None:
+            self._hash_raw(self.read_raw())
+        return self._raw_digest
+
+    def _hash_raw(self, raw):
+        self._raw_digest = content_hash(struct.pack("<2H",
+            self.compression_method, self.decompressed_size), raw)
+        return self._raw_digest
+
+    def _read(self, inst):
+        # read_raw, recorded as the "read" stage.
+        if inst is None:
+            return self.read_raw()
+        t0 = inst.clock()
+        raw = self.read_raw()
+        inst.record("read", self.key, self.compression_method, len(raw),
+                    len(raw), inst.clock() - t0)
+        return raw
+
+    @property
+    def volume_filename(self):
+        return self.resource_map.volume_filename(self.file_id)
+
+    def load(self, do=False):
+        # Here we actually load up the data.  With a disk cache, a previously
+        # decoded payload comes back as a memory-mapped array instead.
+        inst = self.resource_map.instrumentation
+        disk_cache = self.resource_map.disk_cache
+        dedup = self.resource_map.dedup
+        raw = None
+        if dedup is not None:
+            # Identical bytes already decoded for some other resource.  The
+            # payload read for the lookup is kept for decoding on a miss.
+            raw = self._read(inst)
+            shared = dedup.lookup(self._hash_raw(raw))
+            if shared is not None:
+                self._digest, data = shared
+                dedup.intern(self.owner, self._digest, data, self._raw_digest)
+                self.resource_map.cache.put(self.key, data)
+                return data
+        if disk_cache is not None:
+            if inst is not None:
+                t0 = inst.clock()
+            data = disk_cache.load(self.volume_filename, self.offset)
+            if data is not None:
+                self.read_header()
+                if inst is not None:
+                    inst.record("disk", self.key, self.compression_method,
+                                data.nbytes, data.nbytes, inst.clock() - t0)
+                return self._keep(data)
+        if raw is None:
+            raw = self._read(inst)
+        if inst is not None:
+            t1 = inst.clock()
         try:
-            self._data = decomp_funcs[self.compression_method](data, decomp_size)
+            data = decomp_funcs[self.compression_method](raw,
+                                        self.decompressed_size)
         except NotImplementedError:
-            self._data = None
+            return None
+        if inst is not None:
+            inst.record("decompress", self.key, self.compression_method,
+                        self.compressed_size, data.nbytes, inst.clock() - t1)
+        if disk_cache is not None:
+            disk_cache.store(self.volume_filename, self.offset, data)
+        return self._keep(data)
+
+    def _keep(self, data):
+        # Cache freshly loaded data.  With a dedup store it is hashed first,
+        # and the shared copy swapped in if the store already holds it.
+        dedup = self.resource_map.dedup
+        if dedup is not None:
+            self._digest = content_hash(data)
+            data = dedup.intern(self.owner, self._digest, data,
+                                self.raw_digest)
+        self.resource_map.cache.put(self.key, data)
+        return data
+
+    def product(self, name, compute):
+        # A derived array, such as a picture plane, kept in the disk cache
+        # (when there is one) next to the decompressed data.
+        disk_cache = self.resource_map.disk_cache
+        if disk_cache is not None:
+            arr = disk_cache.load(self.volume_filename, self.offset, name)
+            if arr is not None:
+                return arr
+        arr = compute()
+        if disk_cache is not None:
+            disk_cache.store(self.volume_filename, self.offset, arr, name)
+        return arr
+
+    def render(self):
+        # The visual, priority and control planes of a picture.  The picture
+        # is only rendered if some plane is missing from the disk cache.
+        rendered = []
+        def plane(name):
+            if not rendered:
+                rendered.append(self.view.render())
+            return rendered[0][name]
+        return dict((name, self.product(name, lambda: plane(name)))
+                    for name in ("visual", "priority", "control"))
 
     @property
     def view(self):
-        if resource_types[self.r_type] == "text":
-            return self.data.tostring()
-        elif resource_types[self.r_type] == "view":
-            return SCI0View(self.data)
-        elif resource_types[self.r_type] == "font":
-            return SCI0Font(self.data)
-        elif resource_types[self.r_type] == "picture":
-            return SCI0Picture(self.data)
-        elif resource_types[self.r_type] == "sound":
-            return SCI0Sound(self.data)
-        else:
-            raise NotImplementedError
+        # With a dedup store, resources of the same type and contents share
+        # one parsed object.
+        dedup = self.resource_map.dedup
+        if dedup is not None and self.digest is not None:
+            return dedup.parsed(self.r_type, self.digest, self._parse)
+        return self._parse()
+
+    def _parse(self):
+        data = self.data
+        inst = self.resource_map.instrumentation
+        if inst is None:
+            return parse_resource(self.r_type, data)
+        t0 = inst.clock()
+        obj = parse_resource(self.r_type, data)
+        inst.record("parse", self.key, self.compression_method, data.nbytes,
+                    data.nbytes, inst.clock() - t0)
+        return obj
 
     def __repr__(self):
         return "Resource %s: %s (%s vs %s, via %s)" % (self.r_id, resource_types[self.r_type],
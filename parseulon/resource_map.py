@@ -1,14 +1,61 @@
 # This parses a resource map file
 
 import os
+import mmap
+import weakref
 import numpy as np
-from .utils import resource_types, r_dtype, get_high_bits, get_low_bits
+from collections.abc import Mapping
+from .utils import resource_types, type_ids, r_dtype, h_dtype, \
+    get_high_bits, get_low_bits
 from .resource import ResourceEntry
+from .cache import ResourceCache
+
+class VolumeFiles(dict):
+    # Volume handles, opened the first time a resource in them is read.
+    def __init__(self, resource_map):
+        super(VolumeFiles, self).__init__()
+        self.resource_map = weakref.proxy(resource_map)
+
+    def __missing__(self, file_id):
+        f = self[file_id] = self.resource_map.open_volume(file_id)
+        return f
+
+class ResourceIndex(Mapping):
+    # A read-only {rnum: ResourceEntry} view of one resource type, backed by
+    # the map's info array.  Entries are created when first looked up.
+    def __init__(self, resource_map, rtype):
+        self._resource_map = weakref.ref(resource_map)
+        self.rtype = rtype
+        self._entries = {}
+
+    @property
+    def resource_map(self):
+        return self._resource_map()
+
+    def __getitem__(self, rnum):
+        if rnum not in self._entries:
+            i = int(self.resource_map.find(self.rtype, rnum))
+            if i < 0:
+                raise KeyError(rnum)
+            rec = self.resource_map.info[i]
+            self._entries[rnum] = ResourceEntry(self.resource_map,
+                rec["rnum"], self.rtype, rec["rfile"], rec["roff"])
+        return self._entries[rnum]
+
+    def __iter__(self):
+        return iter(self.resource_map.numbers(self.rtype).tolist())
+
+    def __len__(self):
+        return len(self.resource_map.numbers(self.rtype))
+
+    def __contains__(self, rnum):
+        return int(self.resource_map.find(self.rtype, rnum)) >= 0
 
 class ResourceMap(object):
     offset = 0
     _dtype_def = None
-    def __init__(self, filename):
+    def __init__(self, filename, use_mmap = False, cache_size = None,
+                 cache_dir = None, validate = "stat", lazy = False):
         if self._dtype_def is None:
             raise RuntimeError("This class should not be instantiated"
                 "directly.")
@@ -20,20 +67,184 @@ class ResourceMap(object):
         if not os.path.isfile(self.filename):
             raise IOError(self.filename)
         self.resources = {}
+        # With use_mmap, volumes are mapped into memory and resources are
+        # read as zero-copy views of the mapping.
+        self.use_mmap = use_mmap
+        # Decompressed data is held in a cache of at most cache_size bytes;
+        # None keeps everything that has been touched.
+        self.cache = ResourceCache(cache_size)
+        # An optional sidecar directory of decoded data, reused across runs.
+        self.disk_cache = None
+        if cache_dir is not None:
+            from .disk_cache import DiskCache
+            self.disk_cache = DiskCache(cache_dir, validate)
+        # Per-stage timings, off unless instrument() is called.
+        self.instrumentation = None
+        # A DedupStore shared with other maps, set by share().
+        self.dedup = None
 
         self.parse()
-        self.resource_files = {}
-        for i in sorted(np.unique(self.info["rfile"])):
-            fn, _ = self.filename.rsplit(".", 1)
-            self.resource_files[i] = open(fn + ".%03i" % i, "rb")
+        # A sorted (rtype, rnum) key index over info, for vectorized lookups.
+        keys = self.info["rtype"].astype("i8") << 16 | self.info["rnum"]
+        self._key_order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._key_order]
+
+        # In lazy mode volumes are opened, and entries created, on first use;
+        # otherwise everything is set up front.
+        self.lazy = lazy
+        self.resource_files = VolumeFiles(self)
+        if not lazy:
+            for i in sorted(np.unique(self.info["rfile"])):
+                self.resource_files[i]
 
         for rtype, rname in resource_types.items():
-            self.resources[rtype] = self.resources[rname] = {}
+            if lazy:
+                self.resources[rtype] = ResourceIndex(self, rtype)
+            else:
+                self.resources[rtype] = {}
+                ind = (self.info["rtype"] == rtype)
+                for rec in self.info[ind]:
+                    self.resources[rtype][rec["rnum"]] = ResourceEntry(
+                        self, rec["rnum"], rtype, rec["rfile"], rec["roff"])
+            self.resources[rname] = self.resources[rtype]
             setattr(self, rname, self.resources[rname])
-            ind = (self.info["rtype"] == rtype)
-            for rec in self.info[ind]:
-                self.resources[rtype][rec["rnum"]] = ResourceEntry(
-                    self, rec["rnum"], rtype, rec["rfile"], rec["roff"])
+
+    def open_volume(self, file_id):
+        f = open(self.volume_filename(file_id), "rb")
+        if self.use_mmap:
+            with f:
+                f = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f
+
+    def find(self, rtype, rnum):
+        # Row of info for a resource (the last one, if the map repeats it),
+        # or -1.  Both arguments may also be arrays.
+        if isinstance(rtype, str):
+            rtype = self.type_ids(rtype)[0]
+        key = (np.asarray(rtype, dtype="i8") << 16 |
+               np.asarray(rnum, dtype="i8"))
+        i = np.searchsorted(self._sorted_keys, key, side="right") - 1
+        found = (i >= 0) & (self._sorted_keys[np.maximum(i, 0)] == key)
+        return np.where(found, self._key_order[np.maximum(i, 0)], -1)
+
+    def numbers(self, rtype):
+        # Sorted resource numbers of one type.
+        rtype = self.type_ids([rtype])[0]
+        lo, hi = np.searchsorted(self._sorted_keys,
+                                 [rtype << 16, (rtype + 1) << 16])
+        return np.unique(self._sorted_keys[lo:hi] & 0xffff)
+
+    def count(self, types = None):
+        # Number of resources of each type, as {type name: count}.
+        counts = np.bincount(self.info["rtype"],
+                             minlength=max(resource_types) + 1)
+        return dict((resource_types[t], int(counts[t]))
+                    for t in self.type_ids(types))
+
+    def volume_filename(self, file_id):
+        fn, _ = self.filename.rsplit(".", 1)
+        return fn + ".%03i" % file_id
+
+    def type_ids(self, types = None):
+        # Accepts type names or numbers; None means every type.  See
+        # utils.type_ids.
+        return type_ids(types)
+
+    def physical_order(self, types = None):
+        # The rows of info for the given types, sorted by volume and offset.
+        info = self.info[np.isin(self.info["rtype"], self.type_ids(types))]
+        return info[np.lexsort((info["roff"], info["rfile"]))]
+
+    def scan_headers(self):
+        # Read the header of every resource, volume by volume in offset order,
+        # without decompressing anything.  The headers are added to info as
+        # extra columns: method, comp_size (payload only), decomp_size, hinfo,
+        # and "consistent", which is false where the header does not name the
+        # same resource as the map (or could not be read at all).
+        info = self.info
+        headers = np.zeros(info.size, dtype=h_dtype)
+        valid = np.zeros(info.size, dtype="bool")
+        size = h_dtype.itemsize
+        for rfile in np.unique(info["rfile"]):
+            rows = np.nonzero(info["rfile"] == rfile)[0]
+            rows = rows[np.argsort(info["roff"][rows], kind="stable")]
+            offsets = info["roff"][rows].astype("i8")
+            f = self.resource_files[rfile]
+            if self.use_mmap:
+                buf = np.frombuffer(f, dtype="u1")
+                ok = offsets + size <= buf.size
+                idx = offsets[ok, None] + np.arange(size)
+                headers[rows[ok]] = buf[idx].view(h_dtype)[:, 0]
+                valid[rows[ok]] = True
+            else:
+                for row, offset in zip(rows, offsets):
+                    f.seek(offset)
+                    data = f.read(size)
+                    if len(data) == size:
+                        headers[row] = np.frombuffer(data, dtype=h_dtype)[0]
+                        valid[row] = True
+        descr = [(n, info.dtype[n]) for n in r_dtype.names]
+        extended = np.empty(info.size, dtype=descr + [
+            ("method", "<u2"), ("comp_size", "<u2"), ("decomp_size", "<u2"),
+            ("hinfo", "<u2"), ("consistent", "bool")])
+        for n in r_dtype.names:
+            extended[n] = info[n]
+        extended["method"] = headers["method"]
+        extended["comp_size"] = np.where(valid, headers["comp_size"] - 4, 0)
+        extended["decomp_size"] = headers["decomp_size"]
+        extended["hinfo"] = headers["hinfo"]
+        extended["consistent"] = valid & (
+            headers["hinfo"] == (info["rtype"] << 11 | info["rnum"]))
+        self.info = extended
+        return extended
+
+    def instrument(self, enable = True, clock = None):
+        # Start (or stop) collecting read/decompress/parse statistics.
+        # Returns the Instrumentation object, which keeps accumulating
+        # across calls until it is reset.
+        if not enable:
+            self.instrumentation = None
+            return None
+        if self.instrumentation is None:
+            from .instrument import Instrumentation
+            self.instrumentation = Instrumentation()
+        if clock is not None:
+            self.instrumentation.clock = clock
+        return self.instrumentation
+
+    def share(self, store = None):
+        # Decode identical payloads once, across this map and every other
+        # map sharing the same store.  Returns the store.
+        if store is None:
+            from .dedup import DedupStore
+            store = DedupStore()
+        self.dedup = store
+        return store
+
+    def report(self):
+        if self.instrumentation is None:
+            return "Instrumentation is off; call instrument() first."
+        return self.instrumentation.report()
+
+    def iter_resources(self, types = None, decode = True, parse = False,
+                       read_ahead = 1 << 20):
+        # Stream resources in physical (volume, offset) order through large
+        # sequential reads, yielding (type name, number, payload) without
+        # keeping anything behind.
+        from .stream import iter_resources
+        return iter_resources(self, types, decode, parse, read_ahead)
+
+    def iter_decoded(self, types = None, workers = None, parse = False,
+                     chunksize = 32):
+        # Decompress (and optionally parse) resources in a process pool,
+        # yielding (type name, number, data or parsed object) as they finish.
+        from .parallel import iter_decoded
+        return iter_decoded(self, types, workers, parse, chunksize)
+
+    def decode_all(self, types = None, workers = None, parse = False,
+                   chunksize = 32):
+        return dict(((rname, rnum), obj) for rname, rnum, obj in
+            self.iter_decoded(types, workers, parse, chunksize))
 
     def parse(self):
         with open(self.filename, "rb") as f:
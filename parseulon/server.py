@@ -0,0 +1,310 @@
+# A small asyncio HTTP server for previewing the resources of one game
+#
+#   python -m parseulon.server SQ3/ [--host 127.0.0.1] [--port 8000]
+#
+# Routes (GET and HEAD):
+#
+#   /                                  {type name: count}, as JSON
+#   /<type>/                           the resources of a type, as JSON
+#   /<type>/<n>.raw                    compressed payload
+#   /<type>/<n>.bin                    decompressed bytes
+#   /view/<n>.json                     loops and cells of a view
+#   /view/<n>/<loop>/<cell>.png        one image cell
+#   /font/<n>.png                      the glyph atlas of a font
+#   /picture/<n>/<plane>.png           visual, priority or control plane
+#   /sound/<n>.mid                     Standard MIDI File
+#
+# Listings come straight from the map.  Everything else is produced in a
+# process pool, kept in a byte-budgeted cache, and tagged with an ETag made
+# from the volume's fingerprint, the resource's offset and a hash of the
+# product name and its arguments, so that a conditional request is answered
+# with 304 before anything is read.  The map and volumes are re-stat'ed on
+# every request; if any of them has changed, the map is reopened (in the
+# workers too) and the cached products are dropped.
+
+import io
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .utils import type_ids, type_numbers
+from .cache import ResourceCache
+from .disk_cache import volume_fingerprint
+
+# Each worker process keeps its own map open: {(cls, filename): (generation,
+# map)}.  A new generation means the files have changed since it was opened.
+_maps = {}
+
+def _worker_map(cls, filename, generation = None):
+    key = (cls, filename)
+    if key not in _maps or _maps[key][0] != generation:
+        _maps[key] = (generation, cls(filename, use_mmap = True, lazy = True,
+                                      cache_size = 64 << 20))
+    return _maps[key][1]
+
+def _png(pixels, palette = None, transparent = None):
+    from .png import encode_png
+    return encode_png(pixels, palette, transparent)
+
+def produce(cls, filename, rtype, rnum, product, args, generation = None):
+    # Runs in a worker: returns (content type, body) for one product.
+    entry = _worker_map(cls, filename, generation).resources[rtype][rnum]
+    if product == "raw":
+        return "application/octet-stream", bytes(entry.read_raw())
+    if product == "bin":
+        return "application/octet-stream", entry.data.view("u1").tobytes()
+    obj = entry.view
+    if product == "cells":
+        loops = [[{"width": ic.pixels.shape[1], "height": ic.pixels.shape[0],
+                   "x_off": ic.x_off, "y_off": ic.y_off, "key": ic.key}
+                  for ic in loop.image_cells] for loop in obj.cells]
+        return "application/json", json.dumps(loops).encode()
+    if product == "cell":
+        ic = obj.cells[args[0]].image_cells[args[1]]
+        return "image/png", _png(ic.pixels, transparent = ic.key)
+    if product == "font":
+        return "image/png", _png(obj.atlas, [(0, 0, 0), (255, 255, 255)])
+    if product == "plane":
+        return "image/png", _png(entry.render()[args[0]])
+    if product == "midi":
+        buf = io.BytesIO()
+        obj.write_midi(buf)
+        return "audio/midi", buf.getvalue()
+    raise KeyError(product)
+
+class HTTPError(Exception):
+    def __init__(self, status, reason):
+        super(HTTPError, self).__init__(status, reason)
+        self.status = status
+        self.reason = reason
+
+class AssetServer(object):
+    def __init__(self, resource_map, host = "127.0.0.1", port = 8000,
+                 workers = None, cache_bytes = 256 << 20, executor = None):
+        self.resource_map = resource_map
+        self.host = host
+        self.port = port
+        self.executor = executor
+        self.workers = workers
+        # {path: (etag, content type, body)}
+        self.responses = ResourceCache(cache_bytes)
+        # Requests for the same path while it is being produced share one
+        # future instead of each decoding it.
+        self.pending = {}
+        self._load(resource_map)
+
+    def _load(self, resource_map):
+        self.resource_map = resource_map
+        self.info = resource_map.scan_headers()
+        self.generation = self._generation()
+        self.fingerprints = dict(
+            (rfile, volume_fingerprint(resource_map.volume_filename(rfile)))
+            for rfile in set(self.info["rfile"].tolist()))
+
+    def _generation(self):
+        # Fingerprints of the map file and every volume it names.
+        m = self.resource_map
+        files = [m.filename] + [m.volume_filename(rfile) for rfile in
+                                sorted(set(m.info["rfile"].tolist()))]
+        return tuple(volume_fingerprint(fn) if os.path.exists(fn) else None
+                     for fn in files)
+
+    def refresh(self):
+        # Reopen the map if any of its files has changed since it was read,
+        # dropping every cached product.  Returns whether it did.
+        if self._generation() == self.generation:
+            return False
+        m = self.resource_map
+        self._load(type(m)(m.filename, use_mmap = m.use_mmap, lazy = True))
+        self.responses.clear()
+        return True
+
+    def _executor(self):
+        # Workers must not be forked from the serving process, or they would
+        # inherit its open connections and keep them from ever closing.
+        if self.executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn")
+            self.executor = ProcessPoolExecutor(max_workers = self.workers,
+                                                mp_context = context)
+        return self.executor
+
+    def route(self, path):
+        # (rtype, rnum, product, args) for a product path, or a listing.
+        parts = [p for p in path.split("?", 1)[0].split("/") if p]
+        if not parts:
+            return "index", None, None, ()
+        if parts[0] not in type_numbers:
+            raise HTTPError(404, "Not Found")
+        rtype, = type_ids(parts[0])
+        if len(parts) == 1:
+            return "listing", rtype, None, ()
+        try:
+            stem, _, ext = parts[1].partition(".")
+            rnum = int(stem)
+            if len(parts) == 2 and ext in ("raw", "bin"):
+                return ext, rtype, rnum, ()
+            if parts[0] == "view" and len(parts) == 2 and ext == "json":
+                return "cells", rtype, rnum, ()
+            if parts[0] == "view" and len(parts) == 4 and \
+                    parts[3].endswith(".png"):
+                return "cell", rtype, rnum, (int(parts[2]),
+                                             int(parts[3][:-4]))
+            if parts[0] == "font" and len(parts) == 2 and ext == "png":
+                return "font", rtype, rnum, ()
+            if parts[0] == "picture" and len(parts) == 3 and \
+                    parts[2] in ("visual.png", "priority.png",
+                                 "control.png"):
+                return "plane", rtype, rnum, (parts[2][:-4],)
+            if parts[0] == "sound" and len(parts) == 2 and ext == "mid":
+                return "midi", rtype, rnum, ()
+        except ValueError:
+            pass
+        raise HTTPError(404, "Not Found")
+
+    def etag(self, row, product, args):
+        # Volume fingerprint, resource offset, and a hash of (product, args).
+        h = hashlib.sha1(repr((product, args)).encode()).hexdigest()[:8]
+        return '"%s-%x-%s"' % (self.fingerprints[row["rfile"]],
+                               row["roff"], h)
+
+    def listing(self, rtype):
+        info = self.info
+        if rtype is None:
+            return self.resource_map.count()
+        rows = info[info["rtype"] == rtype]
+        return [{"number": int(r["rnum"]), "method": int(r["method"]),
+                 "comp_size": int(r["comp_size"]),
+                 "decomp_size": int(r["decomp_size"]),
+                 "file": int(r["rfile"]), "offset": int(r["roff"])}
+                for r in rows[rows["rnum"].argsort(kind="stable")]]
+
+    async def handle(self, method, path, headers):
+        # Returns (status, reason, headers, body).
+        if method not in ("GET", "HEAD"):
+            raise HTTPError(405, "Method Not Allowed")
+        product, rtype, rnum, args = self.route(path)
+        self.refresh()
+        if product in ("index", "listing"):
+            body = json.dumps(self.listing(rtype)).encode()
+            return 200, "OK", {"Content-Type": "application/json"}, body
+        i = int(self.resource_map.find(rtype, rnum))
+        if i < 0:
+            raise HTTPError(404, "Not Found")
+        etag = self.etag(self.info[i], product, args)
+        common = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [t.strip() for t in
+                    headers.get("if-none-match", "").split(",")]:
+            return 304, "Not Modified", common, b""
+        key = (product, rtype, rnum, args, self.generation)
+        cached = self.responses.get(key)
+        if cached is None or cached[0] != etag:
+            cached = await self._produce(key, etag)
+        _, content_type, body = cached
+        common["Content-Type"] = content_type
+        return 200, "OK", common, body
+
+    async def _produce(self, key, etag):
+        future = self.pending.get(key)
+        owner = future is None
+        if owner:
+            product, rtype, rnum, args, generation = key
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor(), produce,
+                type(self.resource_map), self.resource_map.filename, rtype,
+                rnum, product, args, generation)
+            self.pending[key] = future
+        try:
+            content_type, body = await asyncio.shield(future)
+        except (IndexError, KeyError, NotImplementedError):
+            raise HTTPError(404, "Not Found")
+        finally:
+            if owner:
+                self.pending.pop(key, None)
+        result = (etag, content_type, body)
+        if owner:
+            self.responses.put(key, result, len(body))
+        return result
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, path, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, "GET", 400, "Bad Request",
+                                        {}, b"")
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                try:
+                    status, reason, out, body = await self.handle(method,
+                        path, headers)
+                except HTTPError as e:
+                    status, reason, out, body = e.status, e.reason, {}, b""
+                except Exception as e:
+                    status, reason, out = 500, "Internal Server Error", {}
+                    body = str(e).encode()
+                close = headers.get("connection", "").lower() == "close" \
+                    or version == "HTTP/1.0"
+                await self._respond(writer, method, status, reason, out,
+                                    body, close)
+                if close:
+                    break
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, method, status, reason, headers, body,
+                       close = True):
+        head = ["HTTP/1.1 %s %s" % (status, reason),
+                "Content-Length: %s" % len(body)]
+        if close:
+            head.append("Connection: close")
+        head.extend("%s: %s" % kv for kv in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if method != "HEAD":
+            writer.write(body)
+        await writer.drain()
+
+    async def serve(self):
+        server = await asyncio.start_server(self._connection, self.host,
+                                            self.port, backlog = 1024)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
+def main(argv = None):
+    from .resource_map import ResourceMapSCI0
+    parser = argparse.ArgumentParser()
+    parser.add_argument("game")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--cache-mb", type = int, default = 256)
+    args = parser.parse_args(argv)
+    m = ResourceMapSCI0(args.game, use_mmap = True, lazy = True)
+    AssetServer(m, args.host, args.port, args.workers,
+                args.cache_mb << 20).run()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
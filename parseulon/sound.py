@@ -1,10 +1,5 @@
 import numpy as np
 import struct
-try:
-    import midi
-    Events = midi.events.EventRegistry.Events
-except ImportError:
-    pass
 
 status_codes = {
         0x80: ("NOTE_OFF", 2),
@@ -19,9 +14,73 @@ status_codes = {
         0xFC: ("STOP", 0)
 }
 
+# Number of data bytes that follow each status byte, indexed by status.
+data_lengths = np.zeros(256, dtype="u1")
+for _status, (_name, _nb) in status_codes.items():
+    if _status < 0xF0:
+        data_lengths[_status:_status + 16] = _nb
+
+# Bits of the per-channel hardware mask in the initialization table.
+devices = {
+        "mt32": 0x01,
+        "fb01": 0x02,
+        "adlib": 0x04,
+        "casio": 0x08,
+        "tandy": 0x10,
+        "pcspeaker": 0x20,
+        "amiga": 0x40,
+}
+
+# A delay byte of 0xF8 waits 240 ticks and is followed by another delay byte.
+DELAY_CONTINUE = 0xF8
+TICKS_PER_SECOND = 60
+
+event_dtype = np.dtype([("tick", "<u4"), ("delta", "<u4"),
+                        ("channel", "u1"), ("status", "u1"),
+                        ("data1", "u1"), ("data2", "u1")])
+
+# SMF timing that gives SCI's 60 ticks per second: 30 ticks per quarter
+# note at 500000 microseconds per quarter.
+MIDI_DIVISION = 30
+MIDI_TEMPO = 500000
+
+def _vlq(values):
+    # Encode unsigned ints as MIDI variable-length quantities.  Returns the
+    # bytes (flattened) and the length of each encoding.
+    values = np.asarray(values, dtype="u4")
+    n = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    n = n.astype("i8")
+    starts = np.cumsum(n) - n
+    out = np.zeros(int(n.sum()), dtype="u1")
+    for k in range(4):
+        ok = k < n
+        shift = 7 * (n[ok] - 1 - k)
+        byte = (values[ok] >> shift.astype("u4")) & 0x7f
+        out[starts[ok] + k] = byte | np.where(k < n[ok] - 1, 0x80, 0)
+    return out, n
+
+def encode_track(events):
+    # The body of an MTrk chunk for an array of event_dtype, with explicit
+    # status bytes throughout.
+    delta = np.diff(events["tick"].astype("i8"), prepend=0)
+    vlq, nv = _vlq(delta)
+    nb = data_lengths[events["status"] | events["channel"]].astype("i8")
+    lengths = nv + 1 + nb
+    starts = np.cumsum(lengths) - lengths
+    out = np.zeros(int(lengths.sum()), dtype="u1")
+    vstarts = np.cumsum(nv) - nv
+    out[np.repeat(starts - vstarts, nv) + np.arange(vlq.size)] = vlq
+    pos = starts + nv
+    out[pos] = events["status"] | events["channel"]
+    one = nb > 0
+    out[pos[one] + 1] = events["data1"][one]
+    two = nb == 2
+    out[pos[two] + 2] = events["data2"][two]
+    return out.tobytes()
+
 class Sound(object):
     def __init__(self, data):
-        self.events = []
+        self.events = None
         self.data = data.view("u1")
         self.digital_sample = self.data[0]
         self.initialization = {}
@@ -29,41 +88,105 @@ class Sound(object):
             self.initialization[i] = self.data[1+i*2:1+i*2+2]
         self.eventstream = self.data[33:]
 
+    def channels(self, device = None):
+        # Channels the initialization table enables for a device (a name
+        # from ``devices`` or a mask); None means every channel.
+        if device is None:
+            return list(range(16))
+        mask = devices.get(device, device)
+        return [ch for ch, init in self.initialization.items()
+                if init.size == 2 and init[1] & mask]
+
     def parse_events(self):
-        i = 0
-        while self.eventstream[i] != 0xfc:
-            delay = 0
-            while 1:
-                delay += self.eventstream[i]
-                if self.eventstream[i] != 0xf8:
-                    i += 1
-                    break
+        # Walk the stream once, noting where each event starts and which
+        # status applies to it (running status included), and then pull the
+        # data bytes out for all of them at once.
+        stream = self.eventstream.tobytes()
+        size = len(stream)
+        ticks = []
+        statuses = []
+        positions = []
+        i = tick = 0
+        status = 0
+        while i < size:
+            b = stream[i]
+            if b == 0xfc:
+                break
+            while b == DELAY_CONTINUE:
+                tick += 240
                 i += 1
-            # Only if the first bit is set do we do anything
-            if (self.eventstream[i] & 128):
-                e = self.eventstream[i]
-                if e == 0xfc:
-                    print(i)
+                if i >= size:
                     break
-                channel = e & 0x0f
-                status = e & 0xf0
-                name, nb = status_codes[status]
+                b = stream[i]
+            else:
+                tick += b
                 i += 1
-            if not name.startswith("SYSTEM_DATA"):
-                self.events.append(
-                    Events[status](tick = delay, channel=channel,
-                        data = self.eventstream[i:i+nb]))
-            i += nb
-
-    def write_midi(self, fn):
-        pattern = midi.Pattern()
-        track = midi.Track()
-        pattern.append(track)
-        for e in self.events:
-            track.append(e)
-        eot = midi.EndOfTrackEvent(tick=1)
-        track.append(eot)
-        midi.write_midifile(fn, pattern)
+            if i >= size or stream[i] == 0xfc:
+                break
+            if stream[i] & 0x80:
+                status = stream[i]
+                i += 1
+            if status == 0xF0:
+                # System exclusive data is skipped up to its terminator.
+                end = stream.find(b"\xf7", i)
+                i = size if end < 0 else end + 1
+                continue
+            if status < 0x80 or status > 0xF0:
+                # A data byte with no status to run on, or a system message
+                # that carries no data; neither is an event we can keep.
+                i += 1 if status < 0x80 else 0
+                continue
+            ticks.append(tick)
+            statuses.append(status)
+            positions.append(i)
+            i += int(data_lengths[status])
+        events = np.zeros(len(ticks), dtype=event_dtype)
+        events["tick"] = ticks
+        events["delta"] = np.diff(events["tick"].astype("i8"), prepend=0)
+        statuses = np.array(statuses, dtype="u1")
+        events["channel"] = statuses & 0x0f
+        events["status"] = statuses & 0xf0
+        pos = np.array(positions, dtype="i8")
+        nb = data_lengths[statuses]
+        buf = np.frombuffer(stream + b"\0\0", dtype="u1")
+        events["data1"] = np.where(nb > 0, buf[pos], 0)
+        events["data2"] = np.where(nb > 1, buf[pos + 1], 0)
+        self.events = events
+        return events
+
+    def select(self, channels = None, device = None):
+        # Events on the given channels (or the channels a device plays).
+        events = self.events if self.events is not None \
+            else self.parse_events()
+        if channels is None:
+            channels = self.channels(device)
+        events = events[np.isin(events["channel"], channels)]
+        events["delta"] = np.diff(events["tick"].astype("i8"), prepend=0)
+        return events
+
+    @property
+    def duration(self):
+        # Length of the sound in ticks (60 per second).
+        events = self.events if self.events is not None \
+            else self.parse_events()
+        return int(events["tick"][-1]) if events.size else 0
+
+    @property
+    def seconds(self):
+        return self.duration / float(TICKS_PER_SECOND)
+
+    def write_midi(self, fn, channels = None, device = None):
+        # A format 0 Standard MIDI File; fn is a filename or a file object.
+        events = self.select(channels, device)
+        track = (b"\0\xff\x51\x03" + struct.pack(">I", MIDI_TEMPO)[1:] +
+                 encode_track(events) + b"\0\xff\x2f\0")
+        chunks = (b"MThd" + struct.pack(">IHHH", 6, 0, 1, MIDI_DIVISION) +
+                  b"MTrk" + struct.pack(">I", len(track)) + track)
+        if hasattr(fn, "write"):
+            fn.write(chunks)
+        else:
+            with open(fn, "wb") as f:
+                f.write(chunks)
 
 class SCI0Sound(Sound):
     def __init__(self, data):
@@ -0,0 +1,99 @@
+# Reading resources in the order they sit on disk
+
+import numpy as np
+from .utils import decomp_funcs, resource_types, header_size, unpack_header
+from .resource import try_parse
+
+class VolumeReader(object):
+    # Sequential reads of one volume through a window of at least read_ahead
+    # bytes.  Asking for a range inside the window costs nothing; asking past
+    # it reads the next chunk (keeping whatever part of the window is still
+    # wanted), and jumping well ahead skips the gap with a seek.
+    def __init__(self, f, read_ahead = 1 << 20):
+        self.f = f
+        self.read_ahead = read_ahead
+        self.start = 0
+        self.buf = b""
+        self.n_reads = 0
+
+    def get(self, offset, size):
+        end = self.start + len(self.buf)
+        if offset < self.start or offset + size > end:
+            if self.start <= offset < end:
+                keep = self.buf[offset - self.start:]
+            else:
+                keep = b""
+                self.f.seek(offset)
+            want = max(self.read_ahead, size - len(keep))
+            self.buf = keep + self.f.read(want)
+            self.start = offset
+            self.n_reads += 1
+        i = offset - self.start
+        return self.buf[i:i + size]
+
+class MappedVolumeReader(object):
+    # The same interface over a memory-mapped volume, where every range is
+    # already "in the window".
+    def __init__(self, m):
+        self.view = memoryview(m)
+        self.n_reads = 0
+
+    def get(self, offset, size):
+        return self.view[offset:offset + size]
+
+def iter_resources(resource_map, types = None, decode = True, parse = False,
+                   read_ahead = 1 << 20):
+    # Yields (type name, number, payload) for every resource of the given
+    # types, volume by volume in offset order.  The payload is the raw
+    # compressed bytes without decode, the decompressed array with it, and
+    # with parse the parsed object, or the decompressed array for types
+    # without a parser (see try_parse).  Nothing is
+    # kept once it has been yielded, so memory stays at one read-ahead
+    # window plus the item in hand.
+    inst = resource_map.instrumentation
+    info = resource_map.physical_order(types)
+    for rfile in np.unique(info["rfile"]):
+        rows = info[info["rfile"] == rfile]
+        if resource_map.use_mmap:
+            reader = MappedVolumeReader(resource_map.resource_files[rfile])
+        else:
+            reader = VolumeReader(open(resource_map.volume_filename(rfile),
+                                       "rb"), read_ahead)
+        try:
+            for rtype, rnum, offset in zip(rows["rtype"].tolist(),
+                    rows["rnum"].tolist(), rows["roff"].tolist()):
+                key = (rtype, rnum)
+                if inst is not None:
+                    t0 = inst.clock()
+                try:
+                    _, comp_size, decomp_size, method = unpack_header(
+                        reader.get(offset, header_size))
+                except ValueError:
+                    continue
+                raw = reader.get(offset + header_size, comp_size)
+                if inst is not None:
+                    t1 = inst.clock()
+                    inst.record("read", key, method, len(raw), len(raw),
+                                t1 - t0)
+                if not (decode or parse):
+                    yield resource_types[rtype], rnum, raw
+                    continue
+                try:
+                    data = decomp_funcs[method](raw, decomp_size)
+                except NotImplementedError:
+                    yield resource_types[rtype], rnum, None
+                    continue
+                if inst is not None:
+                    t2 = inst.clock()
+                    inst.record("decompress", key, method, len(raw),
+                                data.nbytes, t2 - t1)
+                if parse:
+                    obj = try_parse(rtype, data)
+                    if inst is not None:
+                        inst.record("parse", key, method, data.nbytes,
+                                    data.nbytes, inst.clock() - t2)
+                    data = obj
+                yield resource_types[rtype], rnum, data
+        finally:
+            if not resource_map.use_mmap:
+                reader.f.close()
@@ -0,0 +1,186 @@
+# Synthetic SCI0 resources, for testing and benchmarking without a game.
+#
+# Every generator takes a numpy random Generator and an approximate size in
+# bytes and returns the uncompressed resource as bytes, laid out the way the
+# parsers in this package read it.  write_corpus puts resources of every
+# type through every compression method into a map and volumes.
+
+import struct
+import numpy as np
+from .utils import resource_types, type_ids
+from .writer import write_resources
+
+def _abs_coord(x, y):
+    return bytes(((x >> 4) & 0xf0 | (y >> 8) & 0x0f, x & 0xff, y & 0xff))
+
+def _rle(pixels):
+    # View cell runs: a repeat count (up to 15) in the high nibble and the
+    # colour in the low one.
+    flat = pixels.ravel()
+    change = np.flatnonzero(np.diff(flat)) + 1
+    starts = np.concatenate([[0], change])
+    lengths = np.diff(np.concatenate([starts, [flat.size]]))
+    colors = flat[starts]
+    full, rest = lengths // 15, lengths % 15
+    counts = np.stack([full, rest > 0], axis=1).ravel()
+    runs = np.repeat(np.stack([np.full_like(rest, 15), rest], axis=1).ravel(),
+                     counts)
+    colors = np.repeat(np.repeat(colors, 2), counts)
+    return (runs << 4 | colors).astype("u1").tobytes()
+
+def synthetic_view(rng, size = 4096):
+    # Loops of cells of blocky random pixels; cells are added until the
+    # view reaches roughly ``size`` bytes.
+    loops = []
+    total = 8
+    while total < size or not loops:
+        cells = []
+        for _ in range(int(rng.integers(1, 5))):
+            ny, nx = rng.integers(4, 48, 2)
+            key = int(rng.integers(0, 16))
+            blocks = rng.integers(0, 16, (ny // 4 + 1, nx // 4 + 1))
+            pixels = np.kron(blocks, np.ones((4, 4), "i8"))[:ny, :nx]
+            cell = struct.pack("<HHbbB", nx, ny, int(rng.integers(-8, 8)),
+                               int(rng.integers(-8, 8)), key) + \
+                _rle(pixels.astype("u1"))
+            cells.append(cell)
+            total += len(cell) + 2
+        loops.append(cells)
+        total += 6
+    n = len(loops)
+    body = bytearray(struct.pack("<HHI", n, 0, 0)) + bytes(2 * n)
+    starts = []
+    for cells in loops:
+        start = len(body)
+        starts.append(start)
+        pos = start + 4 + 2 * len(cells)
+        pointers = []
+        for cell in cells:
+            pointers.append(pos)
+            pos += len(cell)
+        body += struct.pack("<HH%dH" % len(cells), len(cells), 0, *pointers)
+        body += b"".join(cells)
+    struct.pack_into("<%dH" % n, body, 8, *starts)
+    return bytes(body)
+
+def synthetic_picture(rng, size = 4096):
+    # A stream of colour, priority and pattern changes, polylines, pattern
+    # strokes and the occasional fill, ending with 0xff.
+    ops = bytearray()
+    def point():
+        return _abs_coord(int(rng.integers(0, 320)), int(rng.integers(0, 190)))
+    while len(ops) < size - 1:
+        choice = int(rng.integers(0, 10))
+        if choice == 0:
+            ops += bytes((0xf0, int(rng.integers(0, 40))))
+        elif choice == 1:
+            ops += bytes((0xf2, int(rng.integers(0, 16))))
+        elif choice == 2:
+            ops += bytes((0xfb, int(rng.integers(0, 16))))
+        elif choice == 3:
+            ops += bytes((0xf9, int(rng.integers(0, 8)) |
+                          int(rng.integers(0, 2)) << 4))
+        elif choice in (4, 5):
+            ops += bytes((0xf6,)) + b"".join(
+                point() for _ in range(int(rng.integers(2, 8))))
+        elif choice == 6:
+            ops += bytes((0xf7,)) + point() + rng.integers(
+                0, 0xf0, int(rng.integers(1, 8))).astype("u1").tobytes()
+        elif choice == 7:
+            ops += bytes((0xfa,)) + b"".join(
+                point() for _ in range(int(rng.integers(1, 6))))
+        elif choice == 8:
+            ops += bytes((0xf4,)) + point() + rng.integers(
+                0, 0xf0, int(rng.integers(1, 6))).astype("u1").tobytes()
+        elif rng.integers(0, 4) == 0:
+            ops += bytes((0xf8,)) + point()
+    return bytes(ops) + b"\xff"
+
+def synthetic_font(rng, size = 4096, n_chars = 128):
+    # n_chars glyphs of a common height, sized so that the font comes to
+    # roughly ``size`` bytes.
+    # Widths of 1 to 15 pixels average a little under 1.5 bytes a row.
+    per_glyph = max(size - 6 - 2 * n_chars, 0) / float(n_chars)
+    height = int(np.clip((per_glyph - 2) / 1.47, 1, 127))
+    body = bytearray(struct.pack("<HHH", 0, n_chars, height)) + \
+        bytes(2 * n_chars)
+    pointers = []
+    for _ in range(n_chars):
+        width = int(rng.integers(1, 16))
+        bits = rng.integers(0, 2, (height, (width + 7) // 8 * 8)).astype("u1")
+        bits[:, width:] = 0
+        pointers.append(len(body))
+        body += bytes((width, height)) + np.packbits(bits, axis=1).tobytes()
+    struct.pack_into("<%dH" % n_chars, body, 6, *pointers)
+    return bytes(body)
+
+def synthetic_sound(rng, size = 4096):
+    # An initialization table with random device masks and a stream of
+    # notes, controller and program changes using running status.
+    init = bytearray((0,))
+    for _ in range(16):
+        init += bytes((int(rng.integers(1, 8)), int(rng.integers(0, 0x80))))
+    stream = bytearray()
+    status = None
+    while len(init) + len(stream) < size - 1:
+        delay = int(rng.integers(0, 600)) if rng.integers(0, 8) == 0 \
+            else int(rng.integers(0, 24))
+        stream += b"\xf8" * (delay // 240) + bytes((delay % 240,))
+        channel = int(rng.integers(0, 16))
+        kind = int(rng.choice([0x90, 0x90, 0x80, 0xb0, 0xc0, 0xe0]))
+        if kind | channel != status:
+            status = kind | channel
+            stream.append(status)
+        if kind == 0xc0:
+            stream.append(int(rng.integers(0, 128)))
+        else:
+            stream += bytes(int(b) for b in rng.integers(0, 128, 2))
+    return bytes(init + stream) + b"\xfc"
+
+_words = (b"the ship", b"janitor", b"roger", b"wilco", b"orat", b"buckazoid",
+          b"sarien", b"keronian", b"xenon", b"droid", b"you", b"can't",
+          b"do", b"that", b"here", b"nothing", b"happens", b"look", b"at")
+
+def synthetic_text(rng, size = 4096):
+    # NUL terminated messages of random words.
+    messages = []
+    total = 0
+    while total < size:
+        words = [_words[i] for i in rng.integers(0, len(_words),
+                                                 int(rng.integers(2, 16)))]
+        messages.append(b" ".join(words).capitalize() + b".")
+        total += len(messages[-1]) + 1
+    return b"\0".join(messages) + b"\0"
+
+def synthetic_bytes(rng, size = 4096):
+    # Skewed random bytes for the types nothing here parses.
+    return rng.geometric(0.05, size).clip(0, 255).astype("u1").tobytes()
+
+generators = {
+    "view": synthetic_view,
+    "picture": synthetic_picture,
+    "font": synthetic_font,
+    "sound": synthetic_sound,
+    "text": synthetic_text,
+}
+
+def synthetic_resource(rtype, rng, size = 4096):
+    if not isinstance(rtype, str):
+        rtype = resource_types[rtype]
+    return generators.get(rtype, synthetic_bytes)(rng, size)
+
+def corpus_resources(size = 4096, count = 2, methods = (0, 1, 2), seed = 0,
+                     types = None):
+    # (rtype, rnum, method, data) for ``count`` resources of every type
+    # through every method; resource number method * count + i.
+    rng = np.random.default_rng(seed)
+    for rtype in type_ids(types):
+        for method in methods:
+            for i in range(count):
+                yield (rtype, method * count + i, method,
+                       synthetic_resource(rtype, rng, size))
+
+def write_corpus(directory, size = 4096, count = 2, methods = (0, 1, 2),
+                 seed = 0, types = None, max_volume_size = None):
+    return write_resources(directory,
+        corpus_resources(size, count, methods, seed, types), max_volume_size)
@@ -0,0 +1,166 @@
+# Messages of text resources, and a searchable index over them
+#
+# An SCI0 text resource is a run of NUL terminated messages, which the
+# scripts refer to by their position.  build_text_index splits every text
+# resource of a set of games into messages, tokenizes them, and saves an
+# inverted index as .npy files in a directory:
+#
+#   vocab.npy                  sorted tokens
+#   token_start.npy            postings of vocab[i] are [start[i], start[i+1])
+#   post_message.npy           message id of each posting
+#   post_position.npy          token position within that message
+#   msg_game.npy, msg_rnum.npy, msg_index.npy
+#                              which game, resource and message an id is
+#   msg_start.npy, messages.npy
+#                              the message texts, concatenated
+#   games.json                 the game directories
+#
+# TextIndex memory-maps these back, so a search touches only the postings
+# of its tokens and never the games themselves.
+
+import os
+import re
+import json
+import numpy as np
+
+token_re = re.compile(r"[a-z0-9']+")
+
+def split_messages(data):
+    # The messages of one text resource, as str.
+    if isinstance(data, np.ndarray):
+        data = data.view("u1").tobytes()
+    data = bytes(data)
+    messages = data.split(b"\0")
+    if messages and messages[-1] == b"":
+        messages.pop()
+    return [m.decode("latin-1") for m in messages]
+
+def tokenize(message):
+    return token_re.findall(message.lower())
+
+index_files = ("vocab", "token_start", "post_message", "post_position",
+               "msg_game", "msg_rnum", "msg_index", "msg_start", "messages")
+
+def build_text_index(directories, directory):
+    # Index every text resource of the given games into directory.  Returns
+    # the TextIndex.
+    from .resource_map import ResourceMapSCI0
+    games = []
+    msg_game, msg_rnum, msg_index, texts = [], [], [], []
+    postings = {}
+    for game_dir in directories:
+        m = ResourceMapSCI0(game_dir, lazy = True)
+        for _, rnum, data in m.iter_resources(types = ["text"]):
+            for i, message in enumerate(split_messages(data)):
+                mid = len(texts)
+                for pos, token in enumerate(tokenize(message)):
+                    postings.setdefault(token, []).append((mid, pos))
+                msg_game.append(len(games))
+                msg_rnum.append(rnum)
+                msg_index.append(i)
+                texts.append(message)
+        for f in m.resource_files.values():
+            f.close()
+        games.append(os.path.abspath(game_dir))
+
+    vocab = sorted(postings)
+    counts = [len(postings[t]) for t in vocab]
+    flat = [p for t in vocab for p in postings[t]]
+    pairs = np.array(flat, dtype="<i4").reshape((len(flat), 2))
+    encoded = [t.encode("latin-1") for t in texts]
+    arrays = {
+        "vocab": np.array(vocab, dtype="U%i" % max(
+            [len(t) for t in vocab] + [1])),
+        "token_start": np.concatenate([[0], np.cumsum(counts)]).astype("<i8"),
+        "post_message": pairs[:, 0].copy(),
+        "post_position": pairs[:, 1].copy(),
+        "msg_game": np.array(msg_game, dtype="<i4"),
+        "msg_rnum": np.array(msg_rnum, dtype="<i4"),
+        "msg_index": np.array(msg_index, dtype="<i4"),
+        "msg_start": np.concatenate([[0], np.cumsum(
+            [len(t) for t in encoded])]).astype("<i8"),
+        "messages": np.frombuffer(b"".join(encoded), dtype="u1"),
+    }
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name in index_files:
+        np.save(os.path.join(directory, name + ".npy"), arrays[name])
+    with open(os.path.join(directory, "games.json"), "w") as f:
+        json.dump(games, f)
+    return TextIndex(directory)
+
+class TextIndex(object):
+    def __init__(self, directory, mmap_mode = "r"):
+        self.directory = directory
+        for name in index_files:
+            setattr(self, name, np.load(os.path.join(directory,
+                                        name + ".npy"), mmap_mode = mmap_mode))
+        with open(os.path.join(directory, "games.json")) as f:
+            self.games = json.load(f)
+
+    def __len__(self):
+        return self.msg_game.size
+
+    def message(self, mid):
+        start, end = self.msg_start[mid], self.msg_start[mid + 1]
+        return self.messages[start:end].tobytes().decode("latin-1")
+
+    def token_ids(self, token, prefix = False):
+        # The vocabulary range of a token, or of every token it prefixes.
+        lo = np.searchsorted(self.vocab, token, "left")
+        if prefix:
+            hi = np.searchsorted(self.vocab, token + "\uffff", "left")
+        else:
+            hi = np.searchsorted(self.vocab, token, "right")
+        return int(lo), int(hi)
+
+    def postings(self, token, prefix = False):
+        # (message ids, positions) of a token.  Every token's postings are
+        # one contiguous run, as are those of all the tokens of a prefix.
+        lo, hi = self.token_ids(token, prefix)
+        start, end = self.token_start[lo], self.token_start[hi]
+        return (np.asarray(self.post_message[start:end]),
+                np.asarray(self.post_position[start:end]))
+
+    def search(self, query):
+        # Message ids matching a query: its words, in order and adjacent.  A
+        # word ending in "*" matches any token it prefixes.
+        terms = []
+        for word in query.split():
+            tokens = tokenize(word)
+            terms.extend((t, word.endswith("*") and i == len(tokens) - 1)
+                         for i, t in enumerate(tokens))
+        if not terms:
+            return np.zeros(0, dtype="<i4")
+        # Each candidate is a (message, position of the first term) pair.
+        mids, pos = self.postings(*terms[0])
+        keys = np.unique(mids.astype("i8") << 32 | pos)
+        for offset, term in enumerate(terms[1:], 1):
+            if not keys.size:
+                break
+            mids, pos = self.postings(*term)
+            start = pos.astype("i8") - offset
+            ok = start >= 0
+            keys = np.intersect1d(keys,
+                                  mids[ok].astype("i8") << 32 | start[ok])
+        return np.unique(keys >> 32).astype("<i4")
+
+    def results(self, mids):
+        # [(game, resource number, message index, text)] for message ids.
+        return [(self.games[self.msg_game[mid]], int(self.msg_rnum[mid]),
+                 int(self.msg_index[mid]), self.message(mid))
+                for mid in np.asarray(mids).tolist()]
+
+    def find(self, query, game = None):
+        # search(), as results, optionally limited to one game directory.
+        mids = self.search(query)
+        if game is not None:
+            path = os.path.abspath(game)
+            ids = [i for i, g in enumerate(self.games)
+                   if g == path or os.path.basename(g) == game]
+            mids = mids[np.isin(self.msg_game[mids], ids)]
+        return self.results(mids)
+
+    def __repr__(self):
+        return "TextIndex(%s messages, %s tokens, %s games)" % (
+            len(self), self.vocab.size, len(self.games))
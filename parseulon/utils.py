@@ -1,8 +1,8 @@
 # Some utilities for parsing SCI0 resources
 
-import struct
+import numbers
+import hashlib
 import numpy as np
-from yt.utilities.lib.bitarray import bitarray
 
 def get_low_bits(nbits):
     v = 0
@@ -36,129 +36,291 @@ resource_types = {
     8: "cursor",
     9: "patch",
 }
+type_numbers = dict((v, k) for k, v in resource_types.items())
+
+def type_ids(types = None):
+    # Type numbers for type names or numbers (numpy integers included);
+    # None means every type.  Unknown names raise KeyError.
+    if types is None:
+        return sorted(resource_types)
+    if isinstance(types, (str, numbers.Integral)):
+        types = [types]
+    ids = []
+    for t in types:
+        if isinstance(t, numbers.Integral):
+            t = int(t)
+        elif t in type_numbers:
+            t = type_numbers[t]
+        else:
+            raise KeyError(t)
+        ids.append(t)
+    return ids
 
 r_dtype = np.dtype([("rtype", "i4"),
                     ("rnum", "i4"),
                     ("rfile", "i4"),
                     ("roff", "i4")])
 
+# The 8-byte header in front of every resource in a volume.  comp_size
+# counts the last four header bytes as well as the payload.
+h_dtype = np.dtype([("hinfo", "<u2"),
+                    ("comp_size", "<u2"),
+                    ("decomp_size", "<u2"),
+                    ("method", "<u2")])
+header_size = h_dtype.itemsize
+
+def unpack_header(buf, offset = 0):
+    # (hinfo, payload size, decompressed size, method) from the header at
+    # offset in buf.  The payload size is comp_size less the four header
+    # bytes it counts.
+    if len(buf) < offset + header_size:
+        raise ValueError("Truncated resource header at %s" % offset)
+    hinfo, comp_size, decomp_size, method = np.frombuffer(buf,
+        dtype=h_dtype, count=1, offset=offset)[0].item()
+    return hinfo, comp_size - 4, decomp_size, method
+
+def split_resource(buf, offset = 0):
+    # The unpacked header of the resource at offset in buf, and a view of
+    # its compressed payload.
+    header = unpack_header(buf, offset)
+    start = offset + header_size
+    return header, memoryview(buf)[start:start + header[1]]
+
 def decompress_uncompressed(data, final_size):
-    return np.fromstring(data, dtype="c")
+    # A view, not a copy, of whatever buffer we were handed.
+    return np.frombuffer(data, dtype="c")
 
 def decompress_lzw(data, final_size):
     # Python port of the ScummVM system, which is GPLv2+
-    ba = bitarray(size = len(data)*8)
-    ba.ibuf.view("c")[:] = np.fromstring(data, dtype="c")
-    dest = np.zeros(final_size, dtype="<i1")
-    bits = ba.as_bool_array()
+    #
+    # Tokens are pulled LSB-first out of the packed bytes with a shift/mask
+    # bit buffer, and the token table lives in two preallocated arrays of
+    # (start, length) pairs indexing into the output buffer.  A token that
+    # refers to the entry added just before it (the "KwKwK" case) overlaps
+    # its own output, so that copy has to go forward one byte at a time.
+    src = memoryview(data).cast("B")
+    n_src = len(src)
+    dest = bytearray(final_size)
+    token_start = [0] * 0x1000
+    token_length = [0] * 0x1000
     numbits = 9
-    c = d = 0
-    curtoken = 0x0102
+    mask = 0x1ff
     endtoken = 0x1ff
-    tokenlist = {}
+    curtoken = 0x0102
     tokenlastlength = 0
-    tokenlengthlist = {}
-    while not (c == bits.size and d == dest.size):
-        token = bits_to_int(bits[c:c+numbits])
-        c += numbits
+    bitbuf = nbuf = 0
+    c = d = 0
+    while 1:
+        while nbuf < numbits and c < n_src:
+            bitbuf |= src[c] << nbuf
+            nbuf += 8
+            c += 1
+        if nbuf < numbits:
+            break
+        token = bitbuf & mask
+        bitbuf >>= numbits
+        nbuf -= numbits
         if token == 0x101:
-            return dest
+            break
         if token == 0x100:
             numbits = 9
-            endtoken = 0x1ff
+            mask = endtoken = 0x1ff
             curtoken = 0x0102
-        else:
-            if token > 0xff:
-                if token >= curtoken:
-                    print("ERROR!  Bad token", token)
-                    break
-                tokenlastlength = tokenlengthlist[token] + 1
-                dest[d:d+tokenlastlength] = dest[tokenlist[token]:tokenlist[token]+tokenlastlength]
-                d += tokenlastlength
+            continue
+        if token > 0xff:
+            if token >= curtoken:
+                raise RuntimeError("Bad LZW token 0x%x at byte %s (table "
+                                   "ends at 0x%x)" % (token, c, curtoken))
+            s = token_start[token]
+            tokenlastlength = token_length[token] + 1
+            if s + tokenlastlength <= d:
+                dest[d:d+tokenlastlength] = dest[s:s+tokenlastlength]
             else:
-                tokenlastlength = 1
-                dest[d:d+1] = token
-                d += 1
-            if curtoken > endtoken and numbits < 12:
-                numbits += 1
-                endtoken = (endtoken << 1) + 1
-            if curtoken <= endtoken:
-                tokenlist[curtoken] = d - tokenlastlength
-                tokenlengthlist[curtoken] = tokenlastlength
-                curtoken += 1
-    assert(d==dest.size)
-    if c != bits.size:
-        print(c, bits.size, bits.size - c)
-    return dest
+                for i in range(tokenlastlength):
+                    dest[d+i] = dest[s+i]
+            d += tokenlastlength
+        else:
+            tokenlastlength = 1
+            dest[d] = token
+            d += 1
+        if curtoken > endtoken and numbits < 12:
+            numbits += 1
+            endtoken = (endtoken << 1) + 1
+            mask = endtoken
+        if curtoken <= endtoken:
+            token_start[curtoken] = d - tokenlastlength
+            token_length[curtoken] = tokenlastlength
+            curtoken += 1
+    assert(d==final_size)
+    return np.frombuffer(dest, dtype="<i1")
 
 # http://sci.sierrahelp.com/Documentation/SCISpecifications/10-DecompressionAlgorithms.html#AEN990
-class HuffmanBitstream(object):
-    def __init__(self, data, final_size):
-        n_nodes, self.terminator = struct.unpack("<BB", data[:2])
-        dt = np.dtype([ ("value", "c"), ("siblings", "<u1") ])
-        info = np.fromstring(data[2:2+n_nodes*2], dtype=dt)
-        self.nodes = np.empty(n_nodes, dtype = np.dtype([
-          ("value", "c"), ("left", "u1"), ("right", "u1")]))
-        self.nodes["value"] = info["value"]
-        self.nodes["left"] = (info["siblings"] & get_high_bits(4, 8)) >> 4
-        self.nodes["right"] = (info["siblings"] & get_low_bits(4))
-        self.data = np.fromstring(data[2+n_nodes*2:], dtype='uint8')
-        self.old_position = self.position = 0
-        self.bitstream = np.unpackbits(self.data)
-        self.output = np.zeros(final_size, dtype='uint8')
-    
-    def get_next_bit(self):
-        tr = self.bitstream[self.position]
-        self.old_position = self.position
-        self.position += 1
-        return tr
-
-    def get_next_byte(self):
-        tr = self.bitstream[self.position:self.position+8]
-        self.old_position = self.position
-        self.position += 8
-        tr = np.packbits(tr)
-        return tr[0]
-
-    def get_next_char(self):
+class HuffmanDecoder(object):
+    # The node table is flattened into a lookup table indexed by the next
+    # table_bits bits of the stream (MSB first).  Each slot holds every
+    # symbol that can be fully resolved within those bits, so one lookup
+    # emits one or more bytes, and flags whether the window ends on the
+    # terminator or on an escape whose 8-bit literal follows.  Codes that do
+    # not fit in a window fall back to walking the tree a bit at a time.
+    max_depth = 32
+    ESCAPE = -1
+    CONTINUE, TERMINATED, LITERAL = 0, 1, 2
+
+    def __init__(self, data, final_size, table_bits = None):
+        src = memoryview(data).cast("B")
+        n_nodes, self.terminator = src[0], src[1]
+        self.values = bytes(src[2:2+n_nodes*2:2])
+        siblings = bytes(src[3:3+n_nodes*2:2])
+        self.left = [(s & get_high_bits(4, 8)) >> 4 for s in siblings]
+        self.right = [s & get_low_bits(4) for s in siblings]
+        # Pad so that a window can always be assembled from three bytes.
+        self.stream = bytes(src[2+n_nodes*2:]) + b"\0\0\0"
+        self.n_bits = (len(self.stream) - 3) * 8
+        self.final_size = final_size
+        if table_bits is None:
+            table_bits = 12 if len(self.stream) > 4096 else 8
+        self.table_bits = table_bits
+        self.table = self._build_table(table_bits)
+
+    def _codes(self):
+        # Walk the tree once, yielding (code, length, symbol) for every leaf
+        # and every escape prefix (symbol ESCAPE; eight literal bits follow).
+        stack = [(0, 0, 0)]
+        while stack:
+            index, code, length = stack.pop()
+            left, right = self.left[index], self.right[index]
+            if left == right == 0:
+                yield code, length, self.values[index]
+                continue
+            if length >= self.max_depth:
+                continue
+            if right == 0:
+                yield (code << 1) | 1, length + 1, self.ESCAPE
+            else:
+                stack.append((index + right, (code << 1) | 1, length + 1))
+            if left != 0:
+                stack.append((index + left, code << 1, length + 1))
+
+    def _build_table(self, table_bits):
+        # single[k][w] is the first symbol decoded from the k-bit window w,
+        # as (symbol, length), or None if it does not fit.  Escaped literals
+        # get 0x100 or'd in so that, as in ScummVM, they never compare equal
+        # to the terminator.
+        single = [[None]] + [[None] * (1 << k)
+                             for k in range(1, table_bits + 1)]
+        for code, length, symbol in self._codes():
+            for k in range(max(length, 1), table_bits + 1):
+                shift = k - length
+                if symbol != self.ESCAPE:
+                    single[k][code << shift:(code + 1) << shift] = \
+                        [(symbol, length)] * (1 << shift)
+                elif shift < 8:
+                    single[k][code << shift:(code + 1) << shift] = \
+                        [(symbol, length)] * (1 << shift)
+                else:
+                    for literal in range(256):
+                        c = (code << 8) | literal
+                        s = shift - 8
+                        single[k][c << s:(c + 1) << s] = \
+                            [(literal | 0x100, length + 8)] * (1 << s)
+        # multi[k][w] chains symbols: (bytes, bits consumed, state)
+        empty = (b"", 0, self.CONTINUE)
+        multi = [[empty]]
+        for k in range(1, table_bits + 1):
+            row = []
+            for w, first in enumerate(single[k]):
+                if first is None or first[1] == 0:
+                    row.append(empty)
+                    continue
+                symbol, length = first
+                if symbol == self.terminator:
+                    row.append((b"", length, self.TERMINATED))
+                    continue
+                if symbol == self.ESCAPE:
+                    row.append((b"", length, self.LITERAL))
+                    continue
+                rest = multi[k - length][w & ((1 << (k - length)) - 1)]
+                row.append((bytes((symbol & 0xff,)) + rest[0],
+                            length + rest[1], rest[2]))
+            multi.append(row)
+        return multi[table_bits]
+
+    def _get_bits(self, position, n):
+        i = position >> 3
+        window = (self.stream[i] << 16 | self.stream[i+1] << 8 |
+                  self.stream[i+2])
+        return (window >> (24 - n - (position & 7))) & get_low_bits(n)
+
+    def _walk(self, position):
+        # Resolve a single symbol the slow way, one bit at a time.
         index = 0
-        node = self.nodes[index]
-        while 1:
-            if node['left'] == node['right'] == 0:
-                break
-            if self.get_next_bit():
-                next = node['right']
-                if next == 0:
-                    return self.get_next_byte()
+        while self.left[index] or self.right[index]:
+            if position >= self.n_bits:
+                raise RuntimeError("Huffman stream overrun")
+            bit = self._get_bits(position, 1)
+            position += 1
+            if bit:
+                if self.right[index] == 0:
+                    return self._get_bits(position, 8) | 0x100, position + 8
+                index += self.right[index]
             else:
-                next = node['left']
-            index += next
-            node = self.nodes[index]
-        return node['value']
+                index += self.left[index]
+        return self.values[index], position
 
     def decode(self):
-        o = self.output.view('c')
-        i = 0
-        while 1:
-            tr = self.get_next_char()
-            if tr == self.terminator: break
-            # I'm not totally sure how to make this all work together nicely,
-            # what with the bitstream and all that.  So, lots of views, I
-            # guess.
-            o[i] = tr.view('c')
-            i += 1
-        assert(i == o.size)
-        assert(self.bitstream.size - self.position < 8)
-        #import pdb;pdb.set_trace()
-        return self.output.view('c')
+        if not (self.left[0] or self.right[0]):
+            # A lone root leaf consumes no bits at all.
+            value = self.values[0]
+            if value == self.terminator:
+                return np.zeros(0, dtype="uint8").view("c")
+            return np.full(self.final_size, value, dtype="uint8").view("c")
+        output = bytearray()
+        stream = self.stream
+        table = self.table
+        table_bits = self.table_bits
+        mask = get_low_bits(table_bits)
+        n_bits = self.n_bits
+        position = 0
+        while position < n_bits:
+            i = position >> 3
+            window = (stream[i] << 16 | stream[i+1] << 8 | stream[i+2])
+            window = (window >> (24 - table_bits - (position & 7))) & mask
+            symbols, length, state = table[window]
+            if length:
+                output += symbols
+                position += length
+                if state == self.TERMINATED:
+                    break
+                elif state == self.LITERAL:
+                    i = position >> 3
+                    window = (stream[i] << 8 | stream[i+1])
+                    output.append((window >> (8 - (position & 7))) & 0xff)
+                    position += 8
+                continue
+            symbol, position = self._walk(position)
+            if symbol == self.terminator:
+                break
+            output.append(symbol & 0xff)
+        assert(len(output) == self.final_size)
+        assert(n_bits - position < 8)
+        return np.frombuffer(output, dtype="uint8").view("c")
 
 def decompress_huffman(data, final_size):
     # Get the number of nodes and the terminator signal
-    hbs = HuffmanBitstream(data, final_size)
+    hbs = HuffmanDecoder(data, final_size)
     return hbs.decode()
 
 decomp_funcs = {0:decompress_uncompressed, 1:decompress_lzw, 2:decompress_huffman}
 
+def content_hash(*chunks):
+    # A 16-byte blake2b digest over one or more buffers, taken in order.
+    h = hashlib.blake2b(digest_size = 16)
+    for chunk in chunks:
+        if isinstance(chunk, np.ndarray):
+            chunk = np.ascontiguousarray(chunk).view("u1")
+        h.update(chunk)
+    return h.digest()
+
 ega_palette = {
     0:  (0x00, 0x00, 0x00),
     1:  (0x00, 0x00, 0xAA),
@@ -177,3 +339,6 @@ ega_palette = {
     14: (0xFF, 0xFF, 0x55),
     15: (0xFF, 0xFF, 0xFF),
 }
+
+# The same palette as a (16, 3) array, for gathering with palette indices.
+ega_lut = np.array([ega_palette[i] for i in range(16)], dtype="uint8")
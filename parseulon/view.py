@@ -1,6 +1,6 @@
 import numpy as np
 import struct
-from .utils import get_low_bits, get_high_bits, ega_palette
+from .utils import get_low_bits, get_high_bits, ega_lut
 
 class View(object):
     def __init__(self, data):
@@ -11,7 +11,7 @@ class SCI0View(View):
         # http://sci.sierrahelp.com/Documentation/SCISpecifications/14-SCI0%20View%20Resource.html
         super(SCI0View, self).__init__(data)
         # Now we parse
-        sdata = data.tostring()
+        sdata = data.tobytes()
         self.n_groups, self.bitmask, _ = struct.unpack("<HHI", sdata[:8])
         self.cell_indices = struct.unpack("<%sH" % self.n_groups,
             sdata[8:8+2*self.n_groups])
@@ -47,23 +47,29 @@ class SCI0ImageCell(object):
         nx, ny, x_off, y_off, c_key = struct.unpack("<HHbbB", data[:7])
         self.x_off = x_off
         self.y_off = y_off
-        draw_info = np.fromstring(data[7:], "<i1")
+        # Pixels equal to the key colour are transparent.
+        self.key = c_key
+        draw_info = np.frombuffer(data, dtype="u1", offset=7)
         repeats = (draw_info & get_high_bits(4, 8)) >> 4
         colors = (draw_info & get_low_bits(4))
-        im_r = np.zeros(nx*ny, dtype="uint8")
-        im_g = np.zeros(nx*ny, dtype="uint8")
-        im_b = np.zeros(nx*ny, dtype="uint8")
-        im_a = np.zeros(nx*ny, dtype="uint8")
-        cur_pos = 0
-        for c, r in zip(colors, repeats):
-            if c == c_key:
-                im_a[cur_pos:cur_pos + r] = 0
-            else:
-                im_r[cur_pos:cur_pos + r] = ega_palette[c][0]
-                im_g[cur_pos:cur_pos + r] = ega_palette[c][1]
-                im_b[cur_pos:cur_pos + r] = ega_palette[c][2]
-                im_a[cur_pos:cur_pos + r] = 255
-            cur_pos += r
-        self.im = np.array(
-            [im.reshape((nx, ny), order="F")
-             for im in (im_r, im_g, im_b, im_a)]).transpose()
+        # The data may run on past the end of the cell, so only keep the runs
+        # up to the one that fills the last pixel.
+        size = nx*ny
+        n_runs = np.searchsorted(np.cumsum(repeats), size) + 1
+        pixels = np.repeat(colors[:n_runs], repeats[:n_runs])[:size]
+        if pixels.size < size:
+            pixels = np.concatenate([pixels,
+                np.full(size - pixels.size, c_key, dtype="uint8")])
+        self.pixels = pixels.astype("uint8").reshape((ny, nx))
+
+    @property
+    def im(self):
+        return self.rgba()
+
+    def rgba(self):
+        # Expand the palette indices to an (ny, nx, 4) RGBA image.
+        lut = np.zeros((256, 4), dtype="uint8")
+        lut[:16, :3] = ega_lut
+        lut[:16, 3] = 255
+        lut[self.key] = 0
+        return lut[self.pixels]
@@ -0,0 +1,150 @@
+# Writing resource.map and resource.00N volumes
+
+import os
+import struct
+import numpy as np
+from .utils import r_dtype, h_dtype, resource_types, decomp_funcs
+from .compress import comp_funcs
+
+map_entry_fmt = "<HI"
+
+# Limits of the SCI0 formats: 16 bit sizes in the volume headers, and a
+# 6 bit volume number and 26 bit offset packed into each map entry.
+max_resource_size = 0xffff
+max_volumes = 1 << 6
+max_volume_offset = 1 << 26
+
+def pack_resource(rtype, rnum, method, data, compressed = None):
+    # The header and payload of one resource, as they sit in a volume.
+    # When the compressed payload is given, data may be just its
+    # decompressed size.
+    if isinstance(data, int):
+        size = data
+    else:
+        data = memoryview(data).cast("B")
+        size = len(data)
+    if compressed is None:
+        compressed = comp_funcs[method](data)
+    if size > max_resource_size or len(compressed) + 4 > max_resource_size:
+        raise ValueError("Resource %s.%03i is too large for SCI0 (%s bytes,"
+                         " %s compressed)" % (rtype, rnum, size,
+                                              len(compressed)))
+    header = np.array((rtype << 11 | rnum, len(compressed) + 4, size, method),
+                      dtype=h_dtype)
+    return header.tobytes() + compressed
+
+def write_resources(directory, resources, max_volume_size = None):
+    # Write a game's worth of resources.  ``resources`` yields (rtype, rnum,
+    # method, data) in the order they should be laid out, optionally with
+    # the already-compressed payload as a fifth item; a new volume is
+    # started whenever max_volume_size would be exceeded.  Returns the
+    # written index as an r_dtype array.
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    limit = max_volume_offset if max_volume_size is None \
+        else min(max_volume_size, max_volume_offset)
+    rows = []
+    rfile = 0
+    f = open(os.path.join(directory, "resource.%03i" % rfile), "wb")
+    try:
+        for item in resources:
+            rtype, rnum = item[:2]
+            blob = pack_resource(*item)
+            if f.tell() and f.tell() + len(blob) > limit:
+                f.close()
+                rfile += 1
+                if rfile >= max_volumes:
+                    raise ValueError("Too many volumes")
+                f = open(os.path.join(directory, "resource.%03i" % rfile),
+                         "wb")
+            rows.append((rtype, rnum, rfile, f.tell()))
+            f.write(blob)
+    finally:
+        f.close()
+    info = np.array(rows, dtype=r_dtype)
+    write_map(os.path.join(directory, "resource.map"), info)
+    return info
+
+def write_map(filename, info):
+    # A map with one entry per row of info and the all-ones terminator.
+    with open(filename, "wb") as f:
+        for rtype, rnum, rfile, roff in info.tolist():
+            f.write(struct.pack(map_entry_fmt, rtype << 11 | rnum,
+                                rfile << 26 | roff))
+        f.write(b"\xff" * struct.calcsize(map_entry_fmt))
+
+def _key(resource_map, key):
+    rtype, rnum = key
+    return resource_map.type_ids(rtype)[0], int(rnum)
+
+def repack_order(resource_map, order = "type"):
+    # The (rtype, rnum) keys of a map in the order to write them: "type"
+    # (type, then number), "physical" (as the volumes have them), or an
+    # access trace of keys, whose first touches come first and everything
+    # never touched after them by type.
+    info = resource_map.info
+    keys = sorted(set(zip(info["rtype"].tolist(), info["rnum"].tolist())))
+    if isinstance(order, str):
+        if order == "type":
+            return keys
+        if order != "physical":
+            raise ValueError(order)
+        rows = resource_map.physical_order()
+        order = zip(rows["rtype"].tolist(), rows["rnum"].tolist())
+    present = set(keys)
+    seen = set()
+    out = []
+    for key in order:
+        key = _key(resource_map, key)
+        if key in present and key not in seen:
+            seen.add(key)
+            out.append(key)
+    return out + [key for key in keys if key not in seen]
+
+def choose_method(data):
+    # The method that stores data in the fewest bytes, with its payload.
+    best = None
+    for method in sorted(comp_funcs):
+        compressed = comp_funcs[method](data)
+        if best is None or len(compressed) < len(best[1]):
+            best = (method, compressed)
+    return best
+
+def repack_resources(resource_map, order = "type", method = "keep"):
+    # (rtype, rnum, method, data, compressed) for every resource, for
+    # write_resources.  ``method`` is "keep" (copy the payload as it is),
+    # "smallest", a method number, a {key: method} dict (keys not in it are
+    # kept), or a callable taking (key, data) and returning one of those.
+    for key in repack_order(resource_map, order):
+        rtype, rnum = key
+        entry = resource_map.resources[rtype][rnum]
+        raw = entry.read_raw()
+        old = entry.compression_method
+        chosen = method
+        if isinstance(chosen, dict):
+            chosen = chosen.get(key, chosen.get((resource_types[rtype], rnum),
+                                                "keep"))
+        data = None
+        if callable(chosen):
+            data = decomp_funcs[old](raw, entry.decompressed_size)
+            chosen = chosen(key, data)
+        if chosen == "keep" or old not in decomp_funcs:
+            yield rtype, rnum, old, entry.decompressed_size, bytes(raw)
+            continue
+        if data is None:
+            data = decomp_funcs[old](raw, entry.decompressed_size)
+        data = np.asarray(data).view("u1")
+        if chosen == "smallest":
+            chosen, compressed = choose_method(data)
+        elif chosen == old:
+            compressed = bytes(raw)
+        else:
+            compressed = comp_funcs[chosen](data)
+        yield rtype, rnum, chosen, data, compressed
+
+def repack(resource_map, directory, order = "type", method = "keep",
+           max_volume_size = None):
+    # Write a new resource.map and resource.00N set for the map's contents.
+    # See repack_order and repack_resources for order and method.
+    return write_resources(directory,
+        repack_resources(resource_map, order, method), max_volume_size)
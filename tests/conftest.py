@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from parseulon.synthetic import write_corpus, corpus_resources
+
+corpus_args = dict(size = 2048, count = 2, seed = 3)
+
+@pytest.fixture(scope = "session")
+def corpus(tmp_path_factory):
+    # A small synthetic game: every type through every compression method.
+    directory = str(tmp_path_factory.mktemp("corpus"))
+    write_corpus(directory, max_volume_size = 16 << 10, **corpus_args)
+    return directory
+
+@pytest.fixture(scope = "session")
+def corpus_data():
+    # {(rtype, rnum): the bytes written for it}
+    return dict(((rtype, rnum), bytes(memoryview(data).cast("B")))
+                for rtype, rnum, method, data in
+                corpus_resources(**corpus_args))
+
+def as_bytes(data):
+    return np.asarray(data).view("u1").tobytes()
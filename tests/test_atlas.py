@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from parseulon.atlas import Atlas, iter_image_cells, _cell_pixels
+from parseulon.resource_map import ResourceMapSCI0
+
+@pytest.fixture(scope = "module")
+def views(corpus):
+    m = ResourceMapSCI0(corpus, lazy = True)
+    info = m.info[m.info["rtype"] == m.type_ids(["view"])[0]]
+    return dict((rnum, m.resources["view"][rnum].view)
+                for rnum in info["rnum"].tolist())
+
+@pytest.mark.parametrize("dedup", [False, True])
+def test_cells_come_back_from_their_pages(views, dedup):
+    atlas = Atlas.build(views, page_size = 64, dedup = dedup)
+    cells = list(iter_image_cells(views))
+    assert atlas.table.size == len(cells)
+    for vnum, li, ci, ic in cells:
+        row = atlas.lookup(vnum, li, ci)
+        np.testing.assert_array_equal(atlas.image(row), _cell_pixels(ic))
+        assert (atlas.table[row]["x_off"], atlas.table[row]["y_off"]) == \
+            (ic.x_off, ic.y_off)
+    assert atlas.lookup(-1, 0, 0) == -1
+
+def test_save_load_round_trip(views, tmp_path):
+    atlas = Atlas.build(views, page_size = 64)
+    prefix = str(tmp_path / "atlas")
+    atlas.save(prefix)
+    loaded = Atlas.load(prefix)
+    assert isinstance(loaded.pages, np.memmap)
+    np.testing.assert_array_equal(loaded.pages, atlas.pages)
+    np.testing.assert_array_equal(loaded.table, atlas.table)
+    for row in range(atlas.table.size):
+        np.testing.assert_array_equal(loaded.image(row), atlas.image(row))
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from parseulon.catalog import build_catalog, Catalog
+from parseulon.synthetic import write_corpus
+from parseulon.utils import type_ids
+from conftest import as_bytes
+
+@pytest.fixture(scope = "module")
+def games(corpus, tmp_path_factory):
+    other = str(tmp_path_factory.mktemp("other"))
+    write_corpus(other, size = 1024, count = 1, seed = 4)
+    return [corpus, other]
+
+@pytest.fixture(scope = "module")
+def catalog(games, tmp_path_factory):
+    return build_catalog(games, str(tmp_path_factory.mktemp("cat") / "c"))
+
+def test_empty_catalog(tmp_path):
+    catalog = build_catalog([], str(tmp_path / "empty"))
+    assert len(Catalog(catalog.filename)) == 0
+    for conditions in ({}, {"type": "view"}, {"type": ["view", "text"]},
+                       {"number": 0, "min_size": 1}, {"method": [0, 1]}):
+        rows = catalog.query(**conditions)
+        assert rows.size == 0 and "rtype" in rows.dtype.names
+    with pytest.raises(KeyError):
+        catalog.select(game = "missing")
+
+def test_rows_are_sorted_by_type_game_number(catalog):
+    keys = np.stack([catalog["rtype"], catalog["game"], catalog["rnum"]])
+    order = np.lexsort(keys[::-1])
+    np.testing.assert_array_equal(order, np.arange(len(catalog)))
+
+@pytest.mark.parametrize("conditions", [
+    {"type": "view"},
+    {"type": ["view", "text"]},
+    {"type": "sound", "game": 1},
+    {"game": 0, "number": [0, 1]},
+    {"method": 0},
+    {"min_size": 100, "max_size": 1000},
+    {"type": "picture", "max_size": 2000, "size_column": "comp_size"},
+])
+def test_select_matches_a_plain_filter(catalog, conditions):
+    mask = np.ones(len(catalog), dtype="bool")
+    if "type" in conditions:
+        types = type_ids(np.atleast_1d(conditions["type"]).tolist())
+        mask &= np.isin(catalog["rtype"], types)
+    if "game" in conditions:
+        mask &= catalog["game"] == conditions["game"]
+    if "number" in conditions:
+        mask &= np.isin(catalog["rnum"], conditions["number"])
+    if "method" in conditions:
+        mask &= catalog["method"] == conditions["method"]
+    column = catalog[conditions.get("size_column", "decomp_size")]
+    if "min_size" in conditions:
+        mask &= column >= conditions["min_size"]
+    if "max_size" in conditions:
+        mask &= column <= conditions["max_size"]
+    expected = np.nonzero(mask)[0]
+    assert expected.size
+    np.testing.assert_array_equal(catalog.select(**conditions), expected)
+    np.testing.assert_array_equal(catalog.query(**conditions)["row"], expected)
+
+def test_game_by_directory_or_name(catalog, games):
+    by_id = catalog.select(game = 1)
+    np.testing.assert_array_equal(catalog.select(game = games[1]), by_id)
+    np.testing.assert_array_equal(
+        catalog.select(game = games[1].rstrip("/").split("/")[-1]), by_id)
+
+def test_payloads_match_the_corpus(catalog, corpus_data):
+    rows = catalog.select(game = 0)
+    assert rows.size == len(corpus_data)
+    for row in rows.tolist():
+        key = (int(catalog["rtype"][row]), int(catalog["rnum"][row]))
+        assert as_bytes(catalog.payload(row)) == corpus_data[key]
+    catalog.close()
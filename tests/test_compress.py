@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from parseulon.compress import comp_funcs
+from parseulon.resource_map import ResourceMapSCI0
+from parseulon.synthetic import generators
+from parseulon.utils import decomp_funcs
+from conftest import as_bytes
+
+samples = [b"", b"a", b"ab" * 3000, bytes(range(256)) * 40,
+           np.random.default_rng(0).integers(0, 256, 20000,
+                                             dtype="u1").tobytes()]
+samples += [generators[name](np.random.default_rng(1), 4096)
+            for name in sorted(generators)]
+
+@pytest.mark.parametrize("method", sorted(comp_funcs))
+@pytest.mark.parametrize("data", samples)
+def test_round_trip(method, data):
+    compressed = comp_funcs[method](np.frombuffer(data, dtype="u1"))
+    assert as_bytes(decomp_funcs[method](compressed, len(data))) == data
+
+def test_corpus_reads_back(corpus, corpus_data):
+    m = ResourceMapSCI0(corpus)
+    assert m.info.size == len(corpus_data)
+    methods = set()
+    for (rtype, rnum), data in corpus_data.items():
+        entry = m.resources[rtype][rnum]
+        methods.add(entry.compression_method)
+        assert as_bytes(entry.data) == data
+    assert methods == set(comp_funcs)
+
+def test_lzw_bad_token_raises():
+    # 'a', then a token past the end of the table, 9 bits each LSB-first.
+    stream = (0x61 | 0x1f0 << 9).to_bytes(3, "little")
+    with pytest.raises(RuntimeError):
+        decomp_funcs[1](stream, 5)
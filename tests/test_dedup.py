@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from parseulon.dedup import DedupStore
+from parseulon.resource_map import ResourceMapSCI0
+from parseulon.synthetic import write_corpus
+
+@pytest.fixture
+def games(tmp_path):
+    # Two byte-identical games.
+    directories = [str(tmp_path / name) for name in ("a", "b")]
+    for directory in directories:
+        write_corpus(directory, size = 1024, count = 2, seed = 5)
+    return directories
+
+def test_identical_games_share_everything(games):
+    store = DedupStore()
+    maps = [ResourceMapSCI0(d, lazy = True) for d in games]
+    for m in maps:
+        store.add(m)
+    a, b = maps
+    n = a.info.size
+    assert store.info()["owners"] == 2 * n
+    assert store.shared >= n
+    # Everything of the second game was held once already.
+    total = sum(a.resources[t][r].data.nbytes for t, r in
+                zip(a.info["rtype"].tolist(), a.info["rnum"].tolist()))
+    assert store.saved_bytes() == 2 * total - store.buffers.nbytes
+    assert store.saved_bytes() >= total
+    for rtype, rnum in zip(a.info["rtype"].tolist(), a.info["rnum"].tolist()):
+        assert b.resources[rtype][rnum].data is a.resources[rtype][rnum].data
+    view = a.info["rnum"][a.info["rtype"] == a.type_ids(["view"])[0]][0]
+    assert b.resources["view"][view].view is a.resources["view"][view].view
+
+def test_budget_bounds_buffers_objects_and_bookkeeping(games):
+    max_bytes = 4 << 10
+    store = DedupStore(max_bytes)
+    maps = [ResourceMapSCI0(d, lazy = True) for d in games]
+    parsed = ["view", "font", "picture", "sound", "text"]
+    for m in maps:
+        store.add(m)
+        info = m.info[np.isin(m.info["rtype"], m.type_ids(parsed))]
+        for rtype, rnum in zip(info["rtype"].tolist(), info["rnum"].tolist()):
+            m.resources[rtype][rnum].view
+            assert store.buffers.nbytes <= max_bytes
+    assert store.buffers.evictions > 0
+    # What was evicted took its bookkeeping along.
+    for digest in list(store.owners) + list(store.sizes) + \
+            list(store.raw.values()) + list(store.raw_digests):
+        assert digest in store.buffers
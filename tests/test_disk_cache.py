@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+from parseulon.disk_cache import DiskCache
+from parseulon.synthetic import write_corpus
+
+def cached_directories(cache):
+    return sorted(n for n in os.listdir(cache.directory)
+                  if os.path.isdir(os.path.join(cache.directory, n)))
+
+@pytest.mark.parametrize("validate", ["stat", "content"])
+def test_rewritten_volume_replaces_old_entries(tmp_path, validate):
+    game = str(tmp_path / "game")
+    volume = os.path.join(game, "resource.000")
+    write_corpus(game, size = 512, count = 1, seed = 0)
+    cache = DiskCache(str(tmp_path / "cache"), validate)
+    cache.store(volume, 0, np.arange(4))
+    first = cached_directories(cache)
+    write_corpus(game, size = 1024, count = 1, seed = 1)
+    os.utime(volume, ns = (1, 1))
+    cache = DiskCache(cache.directory, validate)
+    assert cache.load(volume, 0) is None
+    cache.store(volume, 0, np.arange(5))
+    second = cached_directories(cache)
+    assert len(second) == 1 and second != first
+
+@pytest.mark.parametrize("validate", ["stat", "content"])
+def test_same_instance_sees_rewritten_volume(tmp_path, validate):
+    game = str(tmp_path / "game")
+    volume = os.path.join(game, "resource.000")
+    write_corpus(game, size = 512, count = 1, seed = 0)
+    cache = DiskCache(str(tmp_path / "cache"), validate)
+    cache.store(volume, 0, np.arange(4))
+    np.testing.assert_array_equal(cache.load(volume, 0), np.arange(4))
+    write_corpus(game, size = 1024, count = 1, seed = 1)
+    os.utime(volume, ns = (1, 1))
+    assert cache.load(volume, 0) is None
+    assert len(cached_directories(cache)) == 1
+
+def test_shared_content_directory_outlives_one_copy(tmp_path):
+    games = [str(tmp_path / name) for name in ("a", "b")]
+    for game in games:
+        write_corpus(game, size = 512, count = 1, seed = 0)
+    volumes = [os.path.join(game, "resource.000") for game in games]
+    cache = DiskCache(str(tmp_path / "cache"), "content")
+    cache.store(volumes[0], 0, np.arange(4))
+    np.testing.assert_array_equal(cache.load(volumes[1], 0), np.arange(4))
+    # Changing one copy leaves the entries the other still uses.
+    write_corpus(games[0], size = 1024, count = 1, seed = 1)
+    cache = DiskCache(cache.directory, "content")
+    assert cache.load(volumes[0], 0) is None
+    np.testing.assert_array_equal(cache.load(volumes[1], 0), np.arange(4))
+    assert len(cached_directories(cache)) == 2
+    # Once the second copy is gone too, cleanup drops the old directory.
+    os.unlink(volumes[1])
+    assert cache.cleanup() == 1
+    assert len(cached_directories(cache)) == 1
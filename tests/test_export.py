@@ -0,0 +1,38 @@
+import os
+import pytest
+from parseulon.export import export_images
+from parseulon.resource_map import ResourceMapSCI0
+
+def written(directory):
+    return dict((fn, os.path.getsize(os.path.join(directory, fn)))
+                for fn in os.listdir(directory))
+
+@pytest.fixture(scope = "module")
+def full(corpus, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("full"))
+    summary = export_images(ResourceMapSCI0(corpus, lazy = True), directory,
+                            workers = 1, level = 1)
+    return summary, written(directory)
+
+def test_export_writes_every_png(full):
+    summary, files = full
+    assert summary["complete"]
+    assert summary["files"] == len(files) > 0
+    assert summary["bytes"] == sum(files.values())
+    assert any(fn.startswith("picture_") for fn in files)
+    assert any(fn.startswith("view_") for fn in files)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export_respects_the_budget(corpus, full, tmp_path, workers):
+    max_bytes = full[0]["bytes"] // 2
+    directory = str(tmp_path / "out")
+    summary = export_images(ResourceMapSCI0(corpus, lazy = True), directory,
+                            workers = workers, max_bytes = max_bytes,
+                            level = 1)
+    files = written(directory)
+    assert not summary["complete"]
+    assert 0 < summary["files"] == len(files) < len(full[1])
+    assert summary["bytes"] == sum(files.values()) <= max_bytes
+    # The files that fit are whole, and the same whatever the workers.
+    for fn, size in files.items():
+        assert full[1][fn] == size
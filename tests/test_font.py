@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from parseulon.font import SCI0Font
+from parseulon.synthetic import synthetic_font
+
+@pytest.fixture(scope = "module")
+def font():
+    data = synthetic_font(np.random.default_rng(2), 2048, n_chars = 128)
+    return SCI0Font(np.frombuffer(data, dtype="u1"))
+
+def glyph_from_data(font, ci):
+    # One glyph decoded straight from the resource bytes.
+    buf = font.data.view("u1")
+    loc = font.char_locations[ci]
+    width, height = buf[loc], buf[loc + 1]
+    row_bytes = (width + 7) // 8
+    rows = buf[loc + 2:loc + 2 + row_bytes * height].reshape(
+        (height, row_bytes))
+    return np.unpackbits(rows, axis=1)[:, :width]
+
+def test_atlas_matches_glyph_data(font):
+    for ci in range(font.glyphs.size):
+        np.testing.assert_array_equal(font.glyph(ci), glyph_from_data(font, ci))
+    assert not font.atlas[:, -1].any()
+
+def test_text_width(font):
+    text = "Hello, world"
+    assert font.text_width(text) == \
+        sum(int(font.glyphs["width"][ord(c)]) for c in text)
+
+def test_render_text_lays_out_glyphs(font):
+    text = "abc"
+    buf = font.render_text(text, color = 3)
+    assert buf.shape == (font.line_height, font.text_width(text))
+    x = 0
+    for c in text:
+        g = font.glyph(ord(c))
+        np.testing.assert_array_equal(buf[:g.shape[0], x:x + g.shape[1]],
+                                      g * 3)
+        x += g.shape[1]
+
+def test_wrap_respects_width(font):
+    text = "the quick brown fox jumps over the lazy dog " * 3
+    max_width = 60
+    lines = font.wrap(text, max_width)
+    assert len(lines) > 1
+    for line in lines:
+        assert font.text_width(line) <= max_width or len(line) == 1
+    assert "".join(lines).replace(" ", "") == text.replace(" ", "")
+    buf = font.render_text(text, max_width)
+    assert buf.shape == (font.line_height * len(lines), max_width)
+
+def test_bytes_and_str_render_alike(font):
+    text = "Roger Wilco\nsweeps the floor"
+    np.testing.assert_array_equal(font.render_text(text.encode(), 50),
+                                  font.render_text(text, 50))
+    np.testing.assert_array_equal(
+        font.render_text(np.frombuffer(text.encode(), dtype="u1")),
+        font.render_text(text))
+
+def test_characters_without_glyphs_are_dropped(font):
+    # The synthetic font has 128 glyphs, so these high characters have none;
+    # wrapping must cut where it measured, not shifted by them.
+    text = "\xe9" * 5 + "abcdefghij" * 4
+    lines = font.wrap(text.encode("latin-1"), 40)
+    assert "".join(lines) == "abcdefghij" * 4
+    for line in lines:
+        assert font.text_width(line) <= 40 or len(line) == 1
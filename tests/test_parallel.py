@@ -0,0 +1,22 @@
+import pytest
+from parseulon.parallel import iter_decoded
+from parseulon.resource_map import ResourceMapSCI0
+from conftest import as_bytes
+
+def payload(obj):
+    # Text parses to bytes; every other parsed object keeps its data.
+    if isinstance(obj, bytes):
+        return obj
+    return as_bytes(getattr(obj, "data", obj))
+
+@pytest.mark.parametrize("parse", [False, True])
+def test_workers_match_serial_decode(corpus, parse):
+    m = ResourceMapSCI0(corpus, lazy = True)
+    serial = dict(((rtype, rnum), obj) for rtype, rnum, obj in
+                  iter_decoded(m, workers = 1, parse = parse))
+    pooled = dict(((rtype, rnum), obj) for rtype, rnum, obj in
+                  iter_decoded(m, workers = 2, parse = parse, chunksize = 4))
+    assert sorted(pooled) == sorted(serial)
+    for key, obj in serial.items():
+        assert type(pooled[key]) is type(obj)
+        assert payload(pooled[key]) == payload(obj)
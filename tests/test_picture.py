@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from parseulon.picture import SCI0Picture, PictureCanvas
+from parseulon.synthetic import synthetic_picture
+
+@pytest.fixture(scope = "module")
+def picture():
+    data = synthetic_picture(np.random.default_rng(5), 4096)
+    return SCI0Picture(np.frombuffer(data, dtype="u1"))
+
+def render_from_scratch(picture, opcode_index):
+    canvas = PictureCanvas()
+    stop = int(np.searchsorted(picture.commands["index"], opcode_index))
+    picture.replay(canvas, 0, stop)
+    return canvas.planes
+
+def assert_planes_equal(a, b):
+    assert sorted(a) == sorted(b)
+    for name in a:
+        np.testing.assert_array_equal(a[name], b[name])
+
+def test_render_until_end_matches_render(picture):
+    n = int(picture.commands["index"][-1]) + 1
+    assert_planes_equal(picture.render_until(n), picture.render())
+
+def test_render_until_matches_scratch(picture):
+    n = int(picture.commands["index"][-1]) + 1
+    # Forwards, backwards and jumping about, with tiny checkpoint spacing
+    # and a budget small enough to force thinning.
+    for every, max_bytes in ((64, 16 << 20), (3, 4 * 3 * 320 * 190)):
+        for k in [0, 1, n // 3, n // 2, n // 2 - 1, 2, n, n - 5, 7, n // 3]:
+            assert_planes_equal(picture.render_until(k, every, max_bytes),
+                                render_from_scratch(picture, k))
+        replay = picture.picture_replay(every, max_bytes)
+        assert replay.max_bytes == max_bytes
+        assert len(replay.checkpoints) == 1 or replay.nbytes <= max_bytes
+
+def test_render_until_returns_copies(picture):
+    planes = picture.render_until(10)
+    planes["visual"][:] = 99
+    assert not (picture.render_until(10)["visual"] == 99).all()
+
+def test_render_until_follows_new_arguments(picture):
+    picture.render_until(10, 64)
+    first = picture.picture_replay(64)
+    picture.render_until(10, 8)
+    assert picture.picture_replay(8) is not first
+    assert 8 in picture.picture_replay(8).checkpoints
+    assert picture.picture_replay(8) is picture.picture_replay(8)
+
+def test_state_keeps_opcode_index(picture):
+    replay = picture.picture_replay()
+    for k in (0, 5, 40):
+        state = replay.state(k)
+        assert state["opcode_index"] == k
+        assert state["palettes"].shape == (4, 40, 2)
+        if k:
+            row = replay._row(k) - 1
+            assert state["opcode"] == int(picture.commands["opcode"][row])
+            assert state["index"] == k - 1
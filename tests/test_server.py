@@ -0,0 +1,47 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from parseulon.resource_map import ResourceMapSCI0
+from parseulon.server import AssetServer, HTTPError
+from parseulon.synthetic import write_corpus
+
+def get(server, path, etag = None):
+    headers = {} if etag is None else {"if-none-match": etag}
+    try:
+        return asyncio.run(server.handle("GET", path, headers))
+    except HTTPError as e:
+        return e.status, e.reason, {}, b""
+
+@pytest.fixture
+def server(tmp_path):
+    game = str(tmp_path / "game")
+    write_corpus(game, size = 1024, count = 1, seed = 0)
+    m = ResourceMapSCI0(game, use_mmap = True, lazy = True)
+    with ThreadPoolExecutor(2) as executor:
+        yield AssetServer(m, executor = executor)
+
+def test_status_codes(server):
+    status, _, headers, body = get(server, "/font/0.raw")
+    assert status == 200
+    assert body == bytes(server.resource_map.resources["font"][0].read_raw())
+    assert get(server, "/font/0.raw", headers["ETag"])[0] == 304
+    assert get(server, "/font/0.bin", headers["ETag"])[0] == 200
+    assert get(server, "/font/99.raw")[0] == 404
+    assert get(server, "/nope/0.raw")[0] == 404
+    status, _, headers, body = get(server, "/view/0/0/0.png")
+    assert status == 200 and body.startswith(b"\x89PNG")
+
+def test_rewritten_volume_is_served_fresh(server):
+    status, _, headers, old = get(server, "/text/0.bin")
+    game = os.path.dirname(server.resource_map.filename)
+    write_corpus(game, size = 2048, count = 1, seed = 1)
+    volume = server.resource_map.volume_filename(0)
+    st = os.stat(volume)
+    os.utime(volume, ns = (st.st_atime_ns, st.st_mtime_ns + 10**9))
+    status, _, new_headers, new = get(server, "/text/0.bin", headers["ETag"])
+    assert status == 200
+    assert new_headers["ETag"] != headers["ETag"]
+    fresh = ResourceMapSCI0(game)
+    data = fresh.resources["text"][0].data
+    assert new == data.view("u1").tobytes() != old
@@ -0,0 +1,79 @@
+import io
+import struct
+import pytest
+from parseulon.resource_map import ResourceMapSCI0
+from parseulon.sound import (data_lengths, MIDI_DIVISION, MIDI_TEMPO,
+                             TICKS_PER_SECOND)
+
+@pytest.fixture(scope = "module")
+def sounds(corpus):
+    m = ResourceMapSCI0(corpus, lazy = True)
+    info = m.info[m.info["rtype"] == m.type_ids(["sound"])[0]]
+    return [m.resources["sound"][rnum].view for rnum in info["rnum"].tolist()]
+
+def read_vlq(data, i):
+    value = 0
+    while True:
+        b = data[i]
+        i += 1
+        value = value << 7 | b & 0x7f
+        if not b & 0x80:
+            return value, i
+
+def read_midi(data):
+    # (division, tempo, [(tick, status, data1, data2)]) of a format 0 file
+    # with explicit status bytes, as write_midi makes them.
+    assert data[:4] == b"MThd"
+    length, fmt, ntracks, division = struct.unpack(">IHHH", data[4:14])
+    assert (length, fmt, ntracks) == (6, 0, 1)
+    assert data[14:18] == b"MTrk"
+    size, = struct.unpack(">I", data[18:22])
+    track = data[22:22 + size]
+    assert len(track) == size == len(data) - 22
+    i = tick = 0
+    tempo = None
+    events = []
+    while i < size:
+        delta, i = read_vlq(track, i)
+        tick += delta
+        status = track[i]
+        i += 1
+        if status == 0xff:
+            kind = track[i]
+            n, i = read_vlq(track, i + 1)
+            if kind == 0x51:
+                tempo = int.from_bytes(track[i:i + n], "big")
+            elif kind == 0x2f:
+                assert i + n == size
+            i += n
+            continue
+        nb = int(data_lengths[status])
+        body = list(track[i:i + nb]) + [0] * (2 - nb)
+        events.append((tick, status, body[0], body[1]))
+        i += nb
+    return division, tempo, events
+
+def expected(events):
+    return [(int(e["tick"]), int(e["status"] | e["channel"]),
+             int(e["data1"]), int(e["data2"])) for e in events]
+
+def test_write_midi_parses_back(sounds):
+    assert sounds
+    for sound in sounds:
+        f = io.BytesIO()
+        sound.write_midi(f)
+        division, tempo, events = read_midi(f.getvalue())
+        assert division == MIDI_DIVISION and tempo == MIDI_TEMPO
+        # 60 SCI ticks per second at this division and tempo.
+        assert division * 1e6 / tempo == TICKS_PER_SECOND
+        assert events == expected(sound.select())
+
+def test_write_midi_to_file_keeps_only_the_device_channels(sounds, tmp_path):
+    for sound in sounds:
+        fn = str(tmp_path / "sound.mid")
+        sound.write_midi(fn, device = "adlib")
+        with open(fn, "rb") as f:
+            division, tempo, events = read_midi(f.read())
+        channels = sound.channels("adlib")
+        assert all(status & 0x0f in channels for _, status, _, _ in events)
+        assert events == expected(sound.select(device = "adlib"))
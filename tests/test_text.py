@@ -0,0 +1,59 @@
+import os
+import pytest
+from parseulon.text import build_text_index, split_messages, tokenize
+from parseulon.utils import type_ids
+from parseulon.writer import write_resources
+
+texts = {
+    "a": [b"Roger Wilco, the janitor.\0You can't do that here.\0",
+          b"Nothing happens.\0Look at the ship!\0"],
+    "b": [b"The janitor's mop.\0Wilco? Roger!\0"],
+}
+
+@pytest.fixture(scope = "module")
+def index(tmp_path_factory):
+    base = tmp_path_factory.mktemp("text")
+    text = type_ids(["text"])[0]
+    games = []
+    for name, resources in sorted(texts.items()):
+        games.append(str(base / name))
+        write_resources(games[-1], [(text, rnum, rnum % 2, data) for
+                                    rnum, data in enumerate(resources)])
+    return build_text_index(games, str(base / "index"))
+
+def found(index, query, game = None):
+    return [(os.path.basename(g), rnum, i)
+            for g, rnum, i, _ in index.find(query, game)]
+
+def test_split_and_tokenize():
+    assert split_messages(texts["a"][0]) == ["Roger Wilco, the janitor.",
+                                             "You can't do that here."]
+    assert tokenize("You can't do THAT.") == ["you", "can't", "do", "that"]
+
+def test_every_message_is_indexed(index):
+    assert len(index) == 6
+    assert index.results([0])[0][1:] == (0, 0, "Roger Wilco, the janitor.")
+
+def test_phrases_match_in_order_and_adjacent(index):
+    assert found(index, "roger wilco") == [("a", 0, 0)]
+    assert found(index, "wilco roger") == [("b", 0, 1)]
+    assert found(index, "Do that") == [("a", 0, 1)]
+    assert found(index, "that do") == []
+    assert found(index, "the") == [("a", 0, 0), ("a", 1, 1), ("b", 0, 0)]
+    assert found(index, "the ship") == [("a", 1, 1)]
+
+def test_prefix_queries(index):
+    assert found(index, "jan*") == [("a", 0, 0), ("b", 0, 0)]
+    assert found(index, "the jan*") == [("a", 0, 0), ("b", 0, 0)]
+    assert found(index, "the jan* mop") == [("b", 0, 0)]
+    assert found(index, "ha*") == [("a", 1, 0)]
+    assert found(index, "zz*") == []
+
+def test_unknown_and_empty_queries(index):
+    assert found(index, "keronian") == []
+    assert found(index, "") == []
+    assert found(index, "...") == []
+
+def test_find_in_one_game(index):
+    assert found(index, "roger", game = "b") == [("b", 0, 1)]
+    assert found(index, "roger", game = "a") == [("a", 0, 0)]
@@ -0,0 +1,40 @@
+import pytest
+from parseulon.compress import comp_funcs
+from parseulon.resource_map import ResourceMapSCI0
+from parseulon.writer import repack
+from conftest import as_bytes
+
+def contents(m):
+    return dict(((rtype, rnum), as_bytes(m.resources[rtype][rnum].data))
+                for rtype, rnum in zip(m.info["rtype"].tolist(),
+                                       m.info["rnum"].tolist()))
+
+@pytest.mark.parametrize("order", ["type", "physical"])
+@pytest.mark.parametrize("method", ["keep", "smallest"] + sorted(comp_funcs))
+def test_repack_round_trip(corpus, corpus_data, tmp_path, order, method):
+    m = ResourceMapSCI0(corpus)
+    out = str(tmp_path / "repacked")
+    info = repack(m, out, order, method, max_volume_size = 8 << 10)
+    repacked = ResourceMapSCI0(out)
+    assert repacked.info.size == info.size == len(corpus_data)
+    assert contents(repacked) == corpus_data
+    if method not in ("keep", "smallest"):
+        assert set(repacked.scan_headers()["method"].tolist()) == {method}
+
+def test_repack_keep_copies_payloads(corpus, tmp_path):
+    m = ResourceMapSCI0(corpus)
+    out = str(tmp_path / "kept")
+    repack(m, out, "physical")
+    repacked = ResourceMapSCI0(out)
+    for rtype, rnum in zip(m.info["rtype"].tolist(), m.info["rnum"].tolist()):
+        assert bytes(repacked.resources[rtype][rnum].read_raw()) == \
+            bytes(m.resources[rtype][rnum].read_raw())
+
+def test_repack_trace_order(corpus, tmp_path):
+    m = ResourceMapSCI0(corpus)
+    trace = [("font", 1), ("view", 3), ("font", 1)]
+    out = str(tmp_path / "traced")
+    repack(m, out, trace)
+    rows = ResourceMapSCI0(out).physical_order()
+    first = list(zip(rows["rtype"].tolist(), rows["rnum"].tolist()))[:2]
+    assert first == [(m.type_ids("font")[0], 1), (m.type_ids("view")[0], 3)]